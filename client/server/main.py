@@ -1,19 +1,36 @@
 import asyncio
-from typing import AsyncGenerator, Dict
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-import platform
 import httpx
+import mimetypes
+import platform
+from pydantic import BaseModel, Field
 from .settings import Settings
 from .services.installer_service import InstallerManager, InstallStartError
 
 
 settings = Settings.load()
-app = FastAPI(title="Software Installer API", version="1.0.0")
+installer_manager = InstallerManager(settings=settings)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 共享的 httpx.AsyncClient 与应用同生命周期，复用到资源服务端的连接
+    await installer_manager.startup()
+    try:
+        yield
+    finally:
+        await installer_manager.shutdown()
+
+
+app = FastAPI(title="Software Installer API", version="1.0.0", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -24,7 +41,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-installer_manager = InstallerManager(settings=settings)
+
+class InstallBatchRequest(BaseModel):
+    keys: List[str] = Field(..., min_length=1)
 
 
 def _detect_os_id() -> str:
@@ -40,26 +59,64 @@ def _detect_os_id() -> str:
 
 
 @app.get("/api/software")
-def list_software() -> Dict[str, object]:
-    base = settings.resource_server_base
-    if not base:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=503, detail="RESOURCE_SERVER_BASE 未配置")
-
+async def list_software() -> Dict[str, object]:
     os_id = _detect_os_id() or "ubuntu"
-    with httpx.Client(timeout=10.0) as client:
-        resp = client.get(f"{base}/api/v1/software", params={"os_id": os_id})
-        resp.raise_for_status()
-        data = resp.json()
+    # 优先返回本地副本并在后台增量同步；只有首次使用时才等待资源服务端
+    try:
+        items = await installer_manager.fetch_catalog(os_id)
+    except InstallStartError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"获取软件目录失败: {e}")
+
+    # 已缓存的图标改由本地提供，URL 带文件版本，浏览器可以长期缓存
+    for item in items:
+        icon = installer_manager.catalog.icon_path(os_id, item["key"])
+        if icon is not None:
+            item["iconUrl"] = f"/api/software/{item['key']}/icon?v={icon.stat().st_mtime_ns}"
 
-    # 填充安装状态，使用服务端提供的检测命令
-    enriched = []
-    for item in data.get("items", []):
-        key = item.get("key")
-        check_command = item.get("checkCommand")
-        item["installed"] = installer_manager.check_installed(key, check_command)
-        enriched.append(item)
-    return {"items": enriched}
+    # 填充安装状态，使用服务端提供的检测命令（并发执行，结果带 TTL 缓存）
+    for item, installed in zip(items, await installer_manager.check_installed_many(items)):
+        item["installed"] = installed
+    return {"items": items}
+
+
+@app.get("/api/software/{key}/icon")
+def get_icon(key: str) -> FileResponse:
+    os_id = _detect_os_id() or "ubuntu"
+    icon = installer_manager.catalog.icon_path(os_id, key)
+    item = installer_manager.catalog.get(os_id, key)
+    if icon is None or item is None:
+        raise HTTPException(status_code=404, detail="图标不存在")
+    media_type = mimetypes.guess_type(item.get("iconUrl") or "")[0] or "application/octet-stream"
+    return FileResponse(icon, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+@app.get("/api/software/check-stats")
+def get_check_stats() -> Dict[str, object]:
+    # 安装状态检测走各路径的次数：which/test/dpkg 在进程内完成，shell 需要 fork
+    return {"counts": dict(installer_manager.check_stats)}
+
+
+@app.get("/api/apt/index")
+def get_apt_index() -> Dict[str, object]:
+    index = installer_manager.apt_index
+    return {
+        "fresh": index.is_fresh(),
+        "refreshedAt": index.refreshed_at,
+        "ttl": index.ttl,
+        "refreshing": index.refreshing,
+    }
+
+
+@app.post("/api/apt/refresh")
+async def refresh_apt_index() -> Dict[str, object]:
+    # 已在 TTL 内则直接返回；否则排队等 dpkg 锁，不与正在进行的安装争抢
+    try:
+        fresh = await installer_manager.refresh_apt_index_now()
+    except InstallStartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"fresh": fresh, "refreshedAt": installer_manager.apt_index.refreshed_at}
 
 
 @app.post("/api/install/{key}")
@@ -71,6 +128,48 @@ async def start_install(key: str) -> Dict[str, object]:
     return {"taskId": task_id}
 
 
+@app.post("/api/install")
+async def start_installs(body: InstallBatchRequest) -> Dict[str, object]:
+    # 多个软件排队安装时走服务端批量接口，一次往返取回全部详情与脚本
+    try:
+        keys = await installer_manager.start_installs(body.keys)
+    except InstallStartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"taskIds": keys}
+
+
+@app.post("/api/bundles/{name}/install")
+async def start_bundle(name: str) -> Dict[str, object]:
+    # 套装按依赖顺序安装，apt 软件合并为一次事务
+    try:
+        return await installer_manager.start_bundle(name)
+    except InstallStartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/install/history")
+def list_install_history(
+    offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=200), key: Optional[str] = None
+) -> Dict[str, object]:
+    # 按结束时间倒序分页，只返回元数据
+    total, items = installer_manager.history.list(offset=offset, limit=limit, key=key)
+    return {"total": total, "offset": offset, "items": items}
+
+
+@app.get("/api/install/history/{record_id}/log")
+def read_install_history_log(
+    record_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(200, ge=1, le=5000),
+    tail: Optional[int] = Query(None, ge=1, le=5000),
+) -> Dict[str, object]:
+    # 只解压覆盖所需行的压缩块；tail 优先于 offset/limit
+    result = installer_manager.history.read_log(record_id, offset=offset, limit=limit, tail=tail)
+    if result is None:
+        raise HTTPException(status_code=404, detail="history record not found")
+    return result
+
+
 @app.get("/api/install/{key}/status")
 def get_status(key: str) -> Dict[str, object]:
     status = installer_manager.get_status(key)
@@ -80,10 +179,20 @@ def get_status(key: str) -> Dict[str, object]:
 
 
 @app.get("/api/install/{key}/stream")
-async def stream_logs(key: str) -> StreamingResponse:
+async def stream_logs(key: str, request: Request) -> StreamingResponse:
+    # EventSource 断线重连时会带上 Last-Event-ID，从该行之后继续推送
+    last_event_id = request.headers.get("last-event-id")
+
     async def generator() -> AsyncGenerator[bytes, None]:
-        async for line in installer_manager.stream_output(key):
-            yield f"data: {line}\n\n".encode()
+        async for kind, event_id, payload in installer_manager.stream_output(key, last_event_id):
+            if kind == "progress":
+                # 结构化进度单独作为 progress 事件推送
+                yield f"event: progress\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+                continue
+            # 每批日志一个 SSE 帧，多行各占一个 data: 字段，浏览器收到后以换行拼接
+            data = "".join(f"data: {line}\n" for line in payload)
+            frame = data if event_id is None else f"id: {event_id}\n{data}"
+            yield f"{frame}\n".encode()
         # signal end of stream (include data for better browser compatibility)
         yield b"event: end\ndata: done\n\n"
 
@@ -93,6 +202,25 @@ async def stream_logs(key: str) -> StreamingResponse:
     return resp
 
 
+@app.get("/api/events")
+async def stream_events(request: Request) -> StreamingResponse:
+    # 所有任务共用的事件流：页面只保持这一个连接，按事件增量更新，不再逐个任务打开 EventSource
+    last_event_id = request.headers.get("last-event-id")
+
+    async def generator() -> AsyncGenerator[bytes, None]:
+        async for kind, event_id, payload in installer_manager.stream_events(last_event_id):
+            if kind == "ping":
+                yield b": ping\n\n"
+                continue
+            frame = f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            yield (frame if event_id is None else f"id: {event_id}\n{frame}").encode()
+
+    resp = StreamingResponse(generator(), media_type="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
 # 静态资源与前端托管
 app.mount("/static", StaticFiles(directory=settings.project_root / "assets"), name="static")
 app.mount("/", StaticFiles(directory=settings.project_root / "web", html=True), name="web")
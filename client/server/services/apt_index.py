@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from .log_buffer import LineAssembler
+
+
+logger = logging.getLogger(__name__)
+
+APT_LISTS_DIR = "/var/lib/apt/lists"
+APT_SOURCES = ("/etc/apt/sources.list", "/etc/apt/sources.list.d")
+
+# 脚本通过这个变量判断能否跳过 apt-get update
+FRESH_ENV = "APPSTORE_APT_INDEX_FRESH"
+
+
+def script_updates_index(content: str) -> bool:
+    """
+    脚本是否按约定使用安装器刷新的索引（引用了 APPSTORE_APT_INDEX_FRESH）
+    无条件执行 apt-get update 的脚本（如修改 sources 的 fix_sources_list）不提前刷新，免得白跑一次
+    """
+    return FRESH_ENV in content
+
+
+class AptIndexRefresher:
+    """
+    由安装器统一负责 apt 索引的新鲜度
+    - TTL 内不重复执行 apt-get update；sources 变化或索引被脚本清空时视为过期
+    - 并发的请求者等待同一次进行中的刷新
+    - 刷新时间记录在 state_path，重启后仍然有效
+    """
+
+    def __init__(self, state_path: Path, ttl: float):
+        self.state_path = state_path
+        self.ttl = ttl
+        self.refreshed_at: Optional[float] = None
+        self._sources_stamp: Optional[float] = None
+        self._inflight: Optional[asyncio.Task] = None
+        self._load()
+
+    def is_fresh(self) -> bool:
+        if self.ttl <= 0 or self.refreshed_at is None:
+            return False
+        if time.time() - self.refreshed_at >= self.ttl:
+            return False
+        return _sources_stamp() == self._sources_stamp and _lists_present()
+
+    @property
+    def refreshing(self) -> bool:
+        return self._inflight is not None
+
+    async def ensure_fresh(self, command: List[str], log: Callable[[List[str]], None]) -> bool:
+        """
+        索引过期时执行一次刷新，已有刷新在进行时等待它完成
+        :param command: 刷新命令（含提权前缀）
+        :param log: 输出行的接收者，通常是请求刷新的安装任务的日志
+        :return: 索引是否新鲜
+        """
+        if self.is_fresh():
+            return True
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._refresh(command, log))
+            self._inflight.add_done_callback(lambda _: setattr(self, "_inflight", None))
+        else:
+            log(["等待进行中的 apt 索引刷新..."])
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self, command: List[str], log: Callable[[List[str]], None]) -> bool:
+        started = time.time()
+        stamp = _sources_stamp()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                env=dict(os.environ, DEBIAN_FRONTEND="noninteractive"),
+            )
+        except Exception as e:
+            log([f"刷新 apt 索引失败: {e}"])
+            return False
+
+        assert process.stdout is not None
+        assembler = LineAssembler()
+        while True:
+            chunk = await process.stdout.read(64 * 1024)
+            if not chunk:
+                break
+            log(assembler.feed(chunk))
+        log(assembler.flush())
+        if await process.wait() != 0:
+            log(["apt 索引刷新失败，交由脚本自行处理"])
+            return False
+
+        # 以开始时间记录：刷新期间 sources 的变化不会被误认为已生效
+        self.refreshed_at = started
+        self._sources_stamp = stamp
+        self._save()
+        return True
+
+    def _load(self) -> None:
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+            self.refreshed_at = float(state["refreshedAt"])
+            self._sources_stamp = float(state["sourcesStamp"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save(self) -> None:
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            self.state_path.write_text(
+                json.dumps({"refreshedAt": self.refreshed_at, "sourcesStamp": self._sources_stamp}),
+                encoding="utf-8",
+            )
+        except OSError as e:
+            logger.warning("failed to save apt index state: %s", e)
+
+
+def _sources_stamp() -> float:
+    stamps = [0.0]
+    for path in APT_SOURCES:
+        try:
+            stamps.append(os.stat(path).st_mtime)
+            if os.path.isdir(path):
+                stamps.extend(entry.stat().st_mtime for entry in os.scandir(path))
+        except OSError:
+            continue
+    return max(stamps)
+
+
+def _lists_present() -> bool:
+    # 部分脚本结束时会 rm -rf /var/lib/apt/lists/*，此时必须重新刷新
+    try:
+        return any("_Packages" in entry.name for entry in os.scandir(APT_LISTS_DIR))
+    except OSError:
+        return False
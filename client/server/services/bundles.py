@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List
+
+
+# 合法的 apt 包名（可带 :arch 或 =version），拒绝任何 shell 元字符
+_APT_PACKAGE = re.compile(r"^[a-z0-9][a-z0-9+.\-]*(:[a-z0-9\-]+)?(=[A-Za-z0-9.+~:\-]+)?$")
+
+
+class BundleError(Exception):
+    pass
+
+
+def bundle_members(catalog: Dict[str, dict], name: str) -> List[str]:
+    """元数据 bundles 字段中包含 name 的软件，按目录顺序返回"""
+    return [key for key, item in catalog.items() if name in (item.get("bundles") or [])]
+
+
+def resolve_order(catalog: Dict[str, dict], keys: Iterable[str]) -> List[str]:
+    """
+    展开 dependsOn 依赖并按拓扑序排列，依赖总在依赖它的软件之前
+    同一层内保持请求顺序；依赖不在目录中或存在环时抛出 BundleError
+    """
+    order: List[str] = []
+    # 0 = 正在访问（用于发现环），1 = 已排好
+    state: Dict[str, int] = {}
+
+    def visit(key: str, path: List[str]) -> None:
+        if state.get(key) == 1:
+            return
+        if state.get(key) == 0:
+            raise BundleError(f"软件依赖存在环: {' -> '.join(path + [key])}")
+        item = catalog.get(key)
+        if item is None:
+            hint = f"（{path[-1]} 的依赖）" if path else " "
+            raise BundleError(f"软件 '{key}'{hint}在服务端不存在")
+        state[key] = 0
+        for dep in item.get("dependsOn") or []:
+            visit(dep, path + [key])
+        state[key] = 1
+        order.append(key)
+
+    for key in dict.fromkeys(keys):
+        visit(key, [])
+    return order
+
+
+def render_apt_script(packages: List[str]) -> bytes:
+    """把一组 apt 包合并成一次 apt-get update + 一次 apt-get install 的脚本"""
+    invalid = [p for p in packages if not _APT_PACKAGE.match(p)]
+    if invalid:
+        raise BundleError(f"无效的 apt 包名: {', '.join(invalid)}")
+    return (
+        "#!/usr/bin/env bash\n"
+        "set -ex\n"
+        '[ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update\n'
+        f"apt-get install -y {' '.join(packages)}\n"
+    ).encode("utf-8")
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+# 并发下载图标的数量
+ICON_CONCURRENCY = 4
+# 从服务端图标合集中取的缩略图边长（页面显示为 72px，兼顾高分屏）
+ICON_BUNDLE_SIZE = 128
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class CatalogSync:
+    """
+    软件目录的本地副本，按服务端的目录版本增量同步
+    - 每次只请求 /api/v1/software/changes?since=<已应用的版本>，目录未变化时响应几乎为空
+    - 服务端要求重置（首次同步、服务端重启等）时整体替换
+    - 已应用的版本与条目持久化到 <root>/catalog-<os_id>.json，客户端重启后继续增量同步
+    - 条目引用的图标缓存到 <root>/icons/<os_id>/<key>，资源服务端不可达时页面照常显示
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._states: Dict[str, dict] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def has(self, os_id: str) -> bool:
+        """是否已有本地副本（内存或磁盘）"""
+        return self._state(os_id) is not None
+
+    def version(self, os_id: str) -> Optional[int]:
+        state = self._state(os_id)
+        return state["version"] if state else None
+
+    def items(self, os_id: str) -> List[dict]:
+        """当前副本中的条目（按 key 排序的浅拷贝，调用方可以直接补充字段）"""
+        state = self._state(os_id)
+        if not state:
+            return []
+        return [dict(state["items"][key]) for key in sorted(state["items"])]
+
+    def get(self, os_id: str, key: str) -> Optional[dict]:
+        state = self._state(os_id)
+        item = state["items"].get(key) if state else None
+        return dict(item) if item else None
+
+    def icon_path(self, os_id: str, key: str) -> Optional[Path]:
+        """已缓存的图标文件，没有时返回 None"""
+        path = self._icon_dir(os_id) / _UNSAFE.sub("_", key)
+        return path if path.is_file() else None
+
+    async def sync(self, http: httpx.AsyncClient, base: str, os_id: str) -> List[dict]:
+        # 同一 os_id 的并发同步串行执行，后到者直接拿到已更新的副本
+        lock = self._locks.setdefault(os_id, asyncio.Lock())
+        async with lock:
+            state = self._state(os_id)
+            params: Dict[str, object] = {"os_id": os_id}
+            if state and state["version"] is not None:
+                params["since"] = state["version"]
+            resp = await http.get(f"{base}/api/v1/software/changes", params=params, timeout=10.0)
+            if resp.status_code == 404:
+                # 旧版资源服务器没有 changes 接口，退回全量列表
+                resp = await http.get(f"{base}/api/v1/software", params={"os_id": os_id}, timeout=10.0)
+                resp.raise_for_status()
+                data = resp.json()
+                delta = {"version": data.get("version"), "reset": True, "added": data.get("items", [])}
+            else:
+                resp.raise_for_status()
+                delta = resp.json()
+
+            reset = bool(delta.get("reset")) or not state
+            items: Dict[str, dict] = {} if reset else dict(state["items"])
+            for item in list(delta.get("added") or []) + list(delta.get("changed") or []):
+                items[item["key"]] = item
+            for key in delta.get("removed") or []:
+                items.pop(key, None)
+
+            new_state = {"version": delta.get("version"), "items": items}
+            self._states[os_id] = new_state
+            if reset or delta.get("added") or delta.get("changed") or delta.get("removed"):
+                await asyncio.to_thread(self._save, os_id, new_state)
+
+            # 新增、变化的条目重新下载图标，缺失的补齐，已删除的清理
+            touched = {item["key"] for item in list(delta.get("added") or []) + list(delta.get("changed") or [])}
+            await self._sync_icons(
+                http, base, os_id, [item for key, item in items.items() if key in touched or not self.icon_path(os_id, key)]
+            )
+            await asyncio.to_thread(self._prune_icons, os_id, set(items))
+        return self.items(os_id)
+
+    async def _sync_icons(self, http: httpx.AsyncClient, base: str, os_id: str, items: List[dict]) -> None:
+        items = [item for item in items if item.get("iconUrl")]
+        if len(items) > 1:
+            # 需要多个图标时先通过图标合集一次取回，合集中缺失或版本不符的再逐个下载
+            bundled = await self._fetch_icon_bundle(http, base, os_id)
+            remaining = []
+            for item in items:
+                icon = bundled.get(item["key"])
+                if icon and f"/assets/{icon.get('hash')}/" in item["iconUrl"]:
+                    content = base64.b64decode(icon["dataUrl"].partition(",")[2])
+                    await asyncio.to_thread(self._write_icon, os_id, item["key"], content)
+                else:
+                    remaining.append(item)
+            items = remaining
+        semaphore = asyncio.Semaphore(ICON_CONCURRENCY)
+
+        async def fetch(item: dict) -> None:
+            async with semaphore:
+                try:
+                    resp = await http.get(item["iconUrl"], timeout=10.0, follow_redirects=True)
+                    resp.raise_for_status()
+                except httpx.HTTPError as e:
+                    logger.warning("failed to cache icon for %s: %s", item["key"], e)
+                    return
+                await asyncio.to_thread(self._write_icon, os_id, item["key"], resp.content)
+
+        await asyncio.gather(*(fetch(item) for item in items))
+
+    async def _fetch_icon_bundle(self, http: httpx.AsyncClient, base: str, os_id: str) -> Dict[str, dict]:
+        try:
+            resp = await http.get(
+                f"{base}/api/v1/software/icons",
+                params={"os_id": os_id, "size": ICON_BUNDLE_SIZE, "format": "png"},
+                timeout=30.0,
+            )
+            resp.raise_for_status()
+            return resp.json().get("icons") or {}
+        except (httpx.HTTPError, ValueError) as e:
+            # 旧版资源服务器没有图标合集，退回逐个下载
+            logger.info("icon bundle unavailable: %s", e)
+            return {}
+
+    def _icon_dir(self, os_id: str) -> Path:
+        return self.root / "icons" / _UNSAFE.sub("_", os_id)
+
+    def _write_icon(self, os_id: str, key: str, content: bytes) -> None:
+        icon_dir = self._icon_dir(os_id)
+        try:
+            icon_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=icon_dir, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_name, icon_dir / _UNSAFE.sub("_", key))
+        except OSError as e:
+            logger.warning("failed to cache icon for %s: %s", key, e)
+
+    def _prune_icons(self, os_id: str, keys: set) -> None:
+        keep = {_UNSAFE.sub("_", key) for key in keys}
+        try:
+            entries = list(os.scandir(self._icon_dir(os_id)))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name not in keep:
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+
+    def _state(self, os_id: str) -> Optional[dict]:
+        if os_id not in self._states:
+            state = self._load(os_id)
+            if state is None:
+                return None
+            self._states[os_id] = state
+        return self._states[os_id]
+
+    def _path(self, os_id: str) -> Path:
+        return self.root / f"catalog-{os_id}.json"
+
+    def _load(self, os_id: str) -> Optional[dict]:
+        try:
+            state = json.loads(self._path(os_id).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or not isinstance(state.get("items"), dict) or "version" not in state:
+            return None
+        return state
+
+    def _save(self, os_id: str, state: dict) -> None:
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".json")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_name, self._path(os_id))
+        except OSError as e:
+            logger.warning("failed to persist catalog for %s: %s", os_id, e)
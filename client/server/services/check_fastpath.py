@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import os
+import re
+import shlex
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+
+# 含这些字符的命令涉及管道/重定向/变量展开等，交给 shell 执行
+_SHELL_META = re.compile(r"[|&;<>()$`*?{}\[\]~\\\n]")
+
+DPKG_STATUS_PATH = "/var/lib/dpkg/status"
+
+_TEST_OPS = {
+    "-e": os.path.exists,
+    "-f": os.path.isfile,
+    "-d": os.path.isdir,
+    "-x": lambda p: os.path.isfile(p) and os.access(p, os.X_OK),
+    "-r": lambda p: os.access(p, os.R_OK),
+    "-s": lambda p: os.path.isfile(p) and os.path.getsize(p) > 0,
+}
+
+
+def evaluate(check_command: str) -> Tuple[Optional[str], Optional[bool]]:
+    """
+    在进程内判定常见的 checkCommand，不 fork shell
+    支持：which X / command -v X / test -x|-f|-e|-d|-r|-s PATH / [ -f PATH ] / dpkg -s pkg
+    :return: (命中的快速路径名称, 结果)；无法识别时返回 (None, None)，调用方回退到 shell
+    """
+    # "[ -f PATH ]" 的方括号单独处理，其余位置出现方括号仍视为通配
+    stripped = check_command.strip()
+    bracket = stripped.startswith("[ ") and stripped.endswith(" ]")
+    body = stripped[2:-2] if bracket else stripped
+    if not body or _SHELL_META.search(body):
+        return None, None
+    try:
+        argv = shlex.split(body)
+    except ValueError:
+        return None, None
+    if not argv:
+        return None, None
+
+    if bracket:
+        return _eval_test(argv)
+
+    cmd, args = argv[0], argv[1:]
+    if cmd == "which" and args and not any(a.startswith("-") for a in args):
+        return "which", all(shutil.which(a) is not None for a in args)
+    if cmd == "command" and len(args) == 2 and args[0] == "-v":
+        return "which", shutil.which(args[1]) is not None
+    if cmd == "test":
+        return _eval_test(args)
+    if cmd == "dpkg" and len(args) >= 2 and args[0] in ("-s", "--status"):
+        if any(a.startswith("-") for a in args[1:]):
+            return None, None
+        return "dpkg", all(_dpkg_index.is_installed(pkg) for pkg in args[1:])
+    return None, None
+
+
+def _eval_test(args: List[str]) -> Tuple[Optional[str], Optional[bool]]:
+    if len(args) != 2 or args[0] not in _TEST_OPS:
+        return None, None
+    try:
+        return "test", bool(_TEST_OPS[args[0]](args[1]))
+    except OSError:
+        return "test", False
+
+
+class DpkgStatusIndex:
+    """/var/lib/dpkg/status 的解析结果，按文件 mtime/size 缓存，变化时重新解析"""
+
+    def __init__(self, path: str = DPKG_STATUS_PATH):
+        self.path = path
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._states: Dict[str, str] = {}
+
+    def is_installed(self, package: str) -> bool:
+        # 与 dpkg -s 一致：有状态记录且不是 not-installed 即视为成功
+        state = self._load().get(package)
+        return state is not None and state != "not-installed"
+
+    def _load(self) -> Dict[str, str]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self._stamp, self._states = None, {}
+            return self._states
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp != self._stamp:
+            self._states = _parse_dpkg_status(self.path)
+            self._stamp = stamp
+        return self._states
+
+
+def _parse_dpkg_status(path: str) -> Dict[str, str]:
+    states: Dict[str, str] = {}
+    package = arch = state = None
+
+    def flush() -> None:
+        if package and state:
+            states[package] = state
+            if arch:
+                states[f"{package}:{arch}"] = state
+
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    flush()
+                    package = arch = state = None
+                elif line.startswith("Package:"):
+                    package = line.split(":", 1)[1].strip()
+                elif line.startswith("Architecture:"):
+                    arch = line.split(":", 1)[1].strip()
+                elif line.startswith("Status:"):
+                    # Status: <want> <flag> <state>
+                    parts = line.split(":", 1)[1].split()
+                    state = parts[-1] if parts else None
+        flush()
+    except OSError:
+        return {}
+    return states
+
+
+_dpkg_index = DpkgStatusIndex()
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import AsyncGenerator, Dict, Optional, Tuple
+
+from .log_buffer import LogRingBuffer
+
+
+# 单个连接一次最多取出的事件数
+EVENT_BATCH_MAX = 500
+# 空闲时发送心跳的间隔，避免代理断开长连接
+HEARTBEAT_INTERVAL = 15.0
+
+
+class EventHub:
+    """
+    所有安装任务的事件（日志、进度、状态变化、安装状态变化）汇总为一条带序号的事件流，
+    页面只需一个 SSE 连接；事件存放在有界环形缓冲区中，断线重连按 Last-Event-ID 续传
+    """
+
+    def __init__(self, max_events: int = 10000, max_bytes: int = 4 * 1024 * 1024):
+        self._buffer = LogRingBuffer(max_lines=max_events, max_bytes=max_bytes)
+
+    @property
+    def last_seq(self) -> int:
+        """最后一个事件的序号，没有事件时为 -1"""
+        return self._buffer.next_seq - 1
+
+    def publish(self, kind: str, payload: Dict[str, object]) -> None:
+        self._buffer.append(json.dumps({"type": kind, "payload": payload}, ensure_ascii=False))
+
+    async def stream(
+        self, last_event_id: Optional[str] = None, flush_interval: float = 0.1, after: Optional[int] = None
+    ) -> AsyncGenerator[Tuple[str, Optional[str], Optional[Dict[str, object]]], None]:
+        """
+        :param last_event_id: SSE Last-Event-ID，从其后继续；为空时只推送连接之后（或 after 之后）的新事件
+        :param after: 调用方已同步到的事件序号（如生成快照时的 last_seq）
+        :return: (事件类型, 事件 ID, 内容)；"reset" 表示中间的事件已被丢弃或 ID 来自之前的进程，调用方需要重新同步；
+                 "ping" 为心跳
+        """
+        buffer = self._buffer
+        cursor = buffer.next_seq if after is None else after + 1
+        if last_event_id:
+            seq = buffer.parse_event_id(last_event_id)
+            if seq is None or seq + 1 > buffer.next_seq:
+                # ID 来自之前的进程（纪元不同）：安装器重启后序号重新开始，需要重新同步
+                yield "reset", None, {"dropped": 0}
+            else:
+                cursor = seq + 1
+        while True:
+            lines, end, dropped = buffer.read(cursor, limit=EVENT_BATCH_MAX)
+            if dropped:
+                yield "reset", None, {"dropped": dropped}
+            first = end - len(lines)
+            for offset, line in enumerate(lines):
+                event = json.loads(line)
+                yield event["type"], buffer.event_id(first + offset), event["payload"]
+            cursor = end
+            if cursor < buffer.next_seq:
+                continue
+            before = buffer.next_seq
+            await buffer.wait(cursor, timeout=HEARTBEAT_INTERVAL)
+            if buffer.next_seq == before:
+                yield "ping", None, None
+                continue
+            # 合并窗口：一次唤醒尽量多取几个事件
+            await asyncio.sleep(flush_interval)
@@ -1,35 +1,145 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import os
 import platform
+import logging
+import time
 import uuid
 from asyncio.subprocess import Process
+from contextlib import contextmanager
 from pathlib import Path
-from typing import AsyncGenerator, Dict, Optional
+from typing import AsyncGenerator, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import shutil
+from collections import Counter
 from ..settings import Settings
+from . import check_fastpath
+from .apt_index import FRESH_ENV, AptIndexRefresher, script_updates_index
+from .bundles import BundleError, bundle_members, render_apt_script, resolve_order
+from .catalog_sync import CatalogSync
+from .event_hub import EventHub
+from .log_buffer import LineAssembler, LogRingBuffer
+from .prefetch import ArtifactPrefetcher
+from .progress import STATUS_PREFIXES, ProgressTracker
+from .scheduler import InstallJob, InstallScheduler, script_needs_dpkg_lock
+from .script_cache import ScriptCache, ScriptHashMismatch
+from .task_history import InstallHistory
+from .task_registry import TaskRegistry
 import httpx
 
 
+logger = logging.getLogger(__name__)
+
+
+OUTPUT_CHUNK_SIZE = 64 * 1024
+# 单个 SSE 帧最多合并的行数
+LOG_BATCH_MAX_LINES = 500
+# 除 APPSTORE_* 外需要带过 pkexec 的变量：apt 的 Status-Fd 配置与非交互模式
+FORWARDED_ENV = ("APT_CONFIG", "DEBIAN_FRONTEND")
+# 手动刷新 apt 索引在调度器中使用的任务名
+APT_REFRESH_JOB = "apt.refresh"
+
+
 class InstallStartError(Exception):
     pass
 
 
 class InstallerTask:
-    def __init__(self, key: str, process: Process):
+    def __init__(self, key: str, log: LogRingBuffer, job: Optional[InstallJob] = None):
         self.key = key
-        self.process = process
-        self.buffer: asyncio.Queue[str] = asyncio.Queue()
+        # 任务排队期间还没有进程，由调度器启动后赋值
+        self.process: Optional[Process] = None
+        self.job = job
+        # 多读者共享的输出缓冲，每个 stream 各自维护游标
+        self.log = log
+        # 从输出中解析出的结构化进度
+        self.progress = ProgressTracker()
         self.done_event = asyncio.Event()
         self.return_code: Optional[int] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # 日志写入安装历史后的记录 id
+        self.history_id: Optional[str] = None
+        # 正在预取安装包，此时尚未进入调度队列
+        self.prefetching = False
+        # 套装安装中必须先成功的任务
+        self.depends_on: List["InstallerTask"] = []
+        # 传给脚本的额外环境变量
+        self.env: Dict[str, str] = {}
+        # 脚本按约定依赖安装器刷新的 apt 索引，运行前先保证索引新鲜
+        self.updates_index = False
 
 
 class InstallerManager:
     def __init__(self, settings: Settings):
         self.settings = settings
-        self.key_to_task: Dict[str, InstallerTask] = {}
+        # 已结束的任务按数量与存活时间淘汰，完整记录落盘到安装历史
+        self.key_to_task = TaskRegistry(settings.task_max_finished, settings.task_max_age)
+        # 正在获取详情与脚本、尚未登记到 key_to_task 的 key，防止并发请求重复启动同一软件
+        self._starting: Set[str] = set()
+        self.history = InstallHistory(settings.history_dir, settings.history_max_records)
+        # 软件目录的本地副本，按版本增量同步
+        self.catalog = CatalogSync(settings.state_dir / "catalog")
+        self._catalog_refreshing: Dict[str, asyncio.Task] = {}
+        # 订阅资源服务端目录变化推送的后台任务
+        self._catalog_watch: Optional[asyncio.Task] = None
+        # 安装任务排队执行，apt/dpkg 类脚本串行，避免争抢 dpkg 锁
+        self.scheduler = InstallScheduler(max_concurrency=settings.install_concurrency)
+        # 按内容哈希缓存下载的脚本，重试同一软件时无需重新下载
+        self.script_cache = ScriptCache(settings.scripts_dir / ".cache")
+        # 安装包在排队拿 dpkg 锁之前并发预取，锁只在真正安装时持有
+        self.prefetcher = ArtifactPrefetcher(
+            settings.scripts_dir / ".artifacts", settings.prefetch_concurrency, settings.artifact_cache_max_bytes
+        )
+        # apt 索引由安装器统一刷新，TTL 内的安装共享同一次 apt-get update
+        self.apt_index = AptIndexRefresher(settings.scripts_dir / ".apt" / "index-state.json", settings.apt_index_ttl)
+        # 排队中的手动刷新，多次请求共享
+        self._apt_refresh: Optional[asyncio.Future] = None
+        # 与资源服务端通信的长连接池，随应用 lifespan 创建/关闭
+        self._http: Optional[httpx.AsyncClient] = None
+        # 安装状态缓存：key -> (过期时间, 检测命令, 是否已安装)
+        self._installed_cache: Dict[str, Tuple[float, Optional[str], bool]] = {}
+        self._check_semaphore: Optional[asyncio.Semaphore] = None
+        # 所有任务的日志、进度、状态变化与安装状态变化，页面通过一个 SSE 连接订阅
+        self.events = EventHub()
+        # 最近一次检测到的安装状态与使用的检测命令，用于推送安装状态的变化
+        self._installed_known: Dict[str, bool] = {}
+        self._check_commands: Dict[str, Optional[str]] = {}
+        # 各检测路径的命中次数（which/test/dpkg 为进程内快速路径，shell 为回退）
+        self.check_stats: Counter = Counter()
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(15.0, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=self.settings.http_max_connections,
+                    max_keepalive_connections=self.settings.http_max_keepalive,
+                    keepalive_expiry=60.0,
+                ),
+            )
+        return self._http
+
+    async def startup(self) -> None:
+        _ = self.http
+        base = self.settings.resource_server_base
+        if base:
+            self._catalog_watch = asyncio.create_task(self._watch_catalog(base, _detect_os_id() or "ubuntu"))
+
+    async def shutdown(self) -> None:
+        if self._catalog_watch is not None:
+            self._catalog_watch.cancel()
+            try:
+                await self._catalog_watch
+            except asyncio.CancelledError:
+                pass
+            self._catalog_watch = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
 
     def check_installed(self, key: str, check_command: Optional[str] = None) -> bool:
         """
@@ -39,6 +149,11 @@ class InstallerManager:
         """
         # 如果提供了检测命令，执行它
         if check_command:
+            fast_path, result = check_fastpath.evaluate(check_command)
+            if fast_path is not None:
+                self.check_stats[fast_path] += 1
+                return bool(result)
+            self.check_stats["shell"] += 1
             try:
                 import subprocess
                 result = subprocess.run(
@@ -63,6 +178,47 @@ class InstallerManager:
         except Exception:
             return False
 
+    async def check_installed_async(self, key: str, check_command: Optional[str] = None) -> bool:
+        """
+        异步版本的 check_installed：结果按 key 缓存 TTL 秒，检测命令用 asyncio 子进程并发执行
+        """
+        now = time.monotonic()
+        cached = self._installed_cache.get(key)
+        if cached is not None and cached[0] > now and cached[1] == check_command:
+            return cached[2]
+
+        fast_path, result = check_fastpath.evaluate(check_command) if check_command else (None, None)
+        if fast_path is not None:
+            self.check_stats[fast_path] += 1
+            installed = bool(result)
+        elif check_command:
+            self.check_stats["shell"] += 1
+            if self._check_semaphore is None:
+                self._check_semaphore = asyncio.Semaphore(self.settings.check_concurrency)
+            async with self._check_semaphore:
+                installed = await _run_check_command(check_command, timeout=5)
+        else:
+            installed = self.check_installed(key)
+
+        self._installed_cache[key] = (time.monotonic() + self.settings.check_ttl, check_command, installed)
+        self._check_commands[key] = check_command
+        previous = self._installed_known.get(key)
+        self._installed_known[key] = installed
+        if previous is not None and previous != installed:
+            self.events.publish("installed", {"key": key, "installed": installed})
+        return installed
+
+    async def check_installed_many(self, items: Iterable[dict]) -> List[bool]:
+        """并发检测一组目录条目（含 key 与 checkCommand），并发数受 check_concurrency 限制"""
+        return list(
+            await asyncio.gather(
+                *(self.check_installed_async(item.get("key"), item.get("checkCommand")) for item in items)
+            )
+        )
+
+    def invalidate_installed(self, key: str) -> None:
+        self._installed_cache.pop(key, None)
+
     def get_software_list(self) -> list:
         res = []
         for item in self.settings.software_list:
@@ -79,56 +235,498 @@ class InstallerManager:
         return None
 
     async def start_install(self, key: str) -> str:
-        if key in self.key_to_task:
-            task = self.key_to_task[key]
-            if task.return_code is None:
-                # already running
-                return key
+        if self._is_running(key):
+            return key
 
         # 必须从服务端获取软件信息
-        base = getattr(self.settings, "resource_server_base", "")
-        if not base:
-            raise InstallStartError("RESOURCE_SERVER_BASE 未配置")
-
+        base = self._require_base()
         os_id = _detect_os_id() or "ubuntu"
-        try:
-            with httpx.Client(timeout=15.0) as client:
+        with self._reserve([key]):
+            try:
                 # 获取软件详情
-                resp = client.get(f"{base}/api/v1/software/{key}", params={"os_id": os_id})
+                resp = await self.http.get(f"{base}/api/v1/software/{key}", params={"os_id": os_id})
                 resp.raise_for_status()
                 data = resp.json()
-                
-                script_url = data.get("scriptUrl")
-                if not script_url:
-                    raise InstallStartError("远程服务端未提供 scriptUrl")
-                
-                requires_root = bool(data.get("requires_root", True))
-                
-                # 从 scriptUrl 中提取脚本文件名，或使用 key 构造
-                script_filename = script_url.split("/")[-1]
-                if not script_filename.endswith(".sh"):
-                    # 如果 URL 中没有文件名，使用 key 构造
-                    script_filename = f"{key}.sh"
-                
-                script_path = (self.settings.scripts_dir / script_filename).resolve()
-
-                content = client.get(script_url, timeout=30.0).content
-                self.settings.scripts_dir.mkdir(parents=True, exist_ok=True)
-                script_path.write_bytes(content)
+                self._check_commands[key] = data.get("checkCommand")
+                script_path = await self._save_script(key, data)
+            except InstallStartError:
+                raise
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 404:
+                    raise InstallStartError(f"软件 '{key}' 在服务端不存在")
+                raise InstallStartError(f"从服务端获取软件信息失败: {e}")
+            except Exception as e:
+                raise InstallStartError(f"获取软件信息失败: {e}")
+
+            await self._launch(
+                key,
+                script_path,
+                bool(data.get("requires_root", True)),
+                self._needs_dpkg_lock(data, script_path),
+                data.get("artifacts"),
+            )
+        return key
+
+    async def start_installs(self, keys: List[str]) -> List[str]:
+        """
+        批量安装：一次批量请求取回全部软件详情和脚本内容，再逐个启动
+        """
+        pending = [k for k in dict.fromkeys(keys) if not self._is_running(k)]
+        if not pending:
+            return list(dict.fromkeys(keys))
+
+        with self._reserve(pending):
+            for item, script_path in await self._fetch_batch(pending):
+                await self._launch(
+                    item["key"],
+                    script_path,
+                    bool(item.get("requires_root", True)),
+                    self._needs_dpkg_lock(item, script_path),
+                    item.get("artifacts"),
+                )
+        return list(dict.fromkeys(keys))
+
+    async def fetch_catalog(self, os_id: str) -> List[dict]:
+        """
+        软件目录（stale-while-revalidate）：有本地副本时立即返回并在后台增量同步，
+        只有首次使用时才等待资源服务端；服务端未配置或不可达时继续使用本地副本
+        """
+        if not self.catalog.has(os_id):
+            return await self.catalog.sync(self.http, self._require_base(), os_id)
+        self.refresh_catalog(os_id)
+        return self.catalog.items(os_id)
+
+    def refresh_catalog(self, os_id: str) -> None:
+        """后台同步一次目录，已有同步在进行时不重复发起；目录变化后推送 catalog 事件"""
+        base = self.settings.resource_server_base
+        if not base or os_id in self._catalog_refreshing:
+            return
+        task = asyncio.create_task(self._refresh_catalog(base, os_id))
+        self._catalog_refreshing[os_id] = task
+        task.add_done_callback(lambda _: self._catalog_refreshing.pop(os_id, None))
+
+    async def _refresh_catalog(self, base: str, os_id: str) -> None:
+        before = self.catalog.version(os_id)
+        try:
+            await self.catalog.sync(self.http, base, os_id)
+        except Exception as e:
+            logger.warning("background catalog refresh failed: %s", e)
+            return
+        version = self.catalog.version(os_id)
+        if version != before:
+            self.events.publish("catalog", {"os_id": os_id, "version": version})
+
+    async def _watch_catalog(self, base: str, os_id: str) -> None:
+        """
+        保持一个到资源服务端 /api/v1/software/events 的长连接，目录版本变化时增量同步，
+        同步后经事件流推送 catalog 事件给页面；断线后指数退避重连
+        """
+        delay = 1.0
+        while True:
+            params: Dict[str, object] = {"os_id": os_id}
+            if self.catalog.version(os_id) is not None:
+                params["since"] = self.catalog.version(os_id)
+            try:
+                # 服务端空闲时每 15 秒发送心跳，读超时用来发现失效的连接
+                async with self.http.stream(
+                    "GET", f"{base}/api/v1/software/events", params=params, timeout=httpx.Timeout(60.0, connect=5.0)
+                ) as resp:
+                    resp.raise_for_status()
+                    delay = 1.0
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        state = json.loads(line[5:])
+                        if state.get("version") != self.catalog.version(os_id):
+                            self.refresh_catalog(os_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.info("catalog event stream disconnected: %s", e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+    async def start_bundle(self, name: str) -> dict:
+        """
+        安装一个套装：按 dependsOn 展开依赖并拓扑排序，已安装的跳过；
+        成员声明的 aptPackages 合并为一次 apt-get update + apt-get install，
+        这些成员在合并事务成功后运行，脚本通过 APPSTORE_APT_BATCHED 跳过自己的 apt 步骤
+        """
+        self._require_base()
+        os_id = _detect_os_id() or "ubuntu"
+        try:
+            catalog = {item["key"]: item for item in await self.fetch_catalog(os_id)}
+        except Exception as e:
+            raise InstallStartError(f"获取软件目录失败: {e}")
+
+        members = bundle_members(catalog, name)
+        if not members:
+            raise InstallStartError(f"套装 '{name}' 不存在")
+        try:
+            order = resolve_order(catalog, members)
+        except BundleError as e:
+            raise InstallStartError(str(e))
+
+        installed = await self.check_installed_many([catalog[k] for k in order])
+        skipped = [k for k, ok in zip(order, installed) if ok]
+        pending = [k for k, ok in zip(order, installed) if not ok and not self._is_running(k)]
+        with self._reserve(pending):
+            return await self._launch_bundle(name, order, skipped, await self._fetch_batch(pending))
+
+    async def _launch_bundle(
+        self, name: str, order: List[str], skipped: List[str], prepared: List[Tuple[dict, Path]]
+    ) -> dict:
+        apt_packages = list(dict.fromkeys(p for item, _ in prepared for p in item.get("aptPackages") or []))
+        apt_task: Optional[InstallerTask] = None
+        task_ids: List[str] = []
+        if apt_packages:
+            try:
+                apt_script = self.script_cache.put(render_apt_script(apt_packages))
+            except BundleError as e:
+                raise InstallStartError(str(e))
+            apt_key = f"{name}.apt"
+            if self._is_running(apt_key):
+                apt_task = self.key_to_task[apt_key]
+            else:
+                apt_task = await self._launch(apt_key, apt_script, True, True)
+            task_ids.append(apt_key)
+
+        for item, script_path in prepared:
+            key = item["key"]
+            depends = [
+                self.key_to_task[dep]
+                for dep in item.get("dependsOn") or []
+                if dep not in skipped and dep in self.key_to_task
+            ]
+            env: Dict[str, str] = {}
+            if apt_task is not None and item.get("aptPackages"):
+                depends.append(apt_task)
+                env["APPSTORE_APT_BATCHED"] = "1"
+            await self._launch(
+                key,
+                script_path,
+                bool(item.get("requires_root", True)),
+                self._needs_dpkg_lock(item, script_path),
+                item.get("artifacts"),
+                depends_on=depends,
+                env=env,
+            )
+            task_ids.append(key)
+        return {"bundle": name, "order": order, "taskIds": task_ids, "skipped": skipped}
+
+    async def _fetch_batch(self, keys: List[str]) -> List[Tuple[dict, Path]]:
+        """一次批量请求取回一组软件的详情和脚本内容，按 keys 的顺序返回 (详情, 脚本路径)"""
+        if not keys:
+            return []
+        base = self._require_base()
+        os_id = _detect_os_id() or "ubuntu"
+        prepared: Dict[str, Tuple[dict, Path]] = {}
+        try:
+            resp = await self.http.post(
+                f"{base}/api/v1/software/batch",
+                json={"keys": keys, "os_id": os_id, "include_scripts": True},
+                timeout=30.0,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            missing = data.get("missing") or []
+            if missing:
+                raise InstallStartError(f"软件 {', '.join(missing)} 在服务端不存在")
+            for item in data.get("items", []):
+                self._check_commands[item["key"]] = item.get("checkCommand")
+                prepared[item["key"]] = (item, await self._save_script(item["key"], item))
+        except InstallStartError:
+            raise
         except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                raise InstallStartError(f"软件 '{key}' 在服务端不存在")
             raise InstallStartError(f"从服务端获取软件信息失败: {e}")
         except Exception as e:
             raise InstallStartError(f"获取软件信息失败: {e}")
+        return [prepared[k] for k in keys if k in prepared]
+
+    def _is_running(self, key: str) -> bool:
+        if key in self._starting:
+            return True
+        task = self.key_to_task.get(key)
+        return task is not None and task.return_code is None
 
+    @contextmanager
+    def _reserve(self, keys: List[str]) -> Iterator[None]:
+        """
+        在第一次 await 之前占用这些 key，直到任务登记到 key_to_task（或启动失败）为止；
+        期间同一 key 的并发请求视为已在运行
+        """
+        self._starting.update(keys)
+        try:
+            yield
+        finally:
+            self._starting.difference_update(keys)
+
+    def _require_base(self) -> str:
+        base = getattr(self.settings, "resource_server_base", "")
+        if not base:
+            raise InstallStartError("RESOURCE_SERVER_BASE 未配置")
+        return base
+
+    async def _save_script(self, key: str, data: dict) -> Path:
+        """
+        取得可执行的脚本路径：按服务端给出的 scriptHash 命中本地缓存时不再下载；
+        批量接口已内联脚本内容时也不再单独下载
+        """
+        script_url = data.get("scriptUrl")
+        if not script_url:
+            raise InstallStartError("远程服务端未提供 scriptUrl")
+
+        expected_hash = data.get("scriptHash")
+        cached = self.script_cache.get(expected_hash)
+        if cached is not None:
+            return cached
+
+        inline = data.get("script")
+        if isinstance(inline, str):
+            content = inline.encode("utf-8")
+        else:
+            resp = await self.http.get(script_url, timeout=30.0, follow_redirects=True)
+            resp.raise_for_status()
+            content = resp.content
+        try:
+            return self.script_cache.put(content, expected_hash)
+        except ScriptHashMismatch as e:
+            raise InstallStartError(f"软件 '{key}' 的{e}")
+
+    async def _launch(
+        self,
+        key: str,
+        script_path: Path,
+        requires_root: bool,
+        needs_dpkg_lock: bool,
+        artifacts: Optional[List[dict]] = None,
+        depends_on: Optional[List[InstallerTask]] = None,
+        env: Optional[Dict[str, str]] = None,
+    ) -> InstallerTask:
+        """
+        创建任务并交给调度器排队，真正的子进程在轮到它时才启动
+        :param artifacts: 元数据声明的安装包，先并发预取完再排队，下载期间不占用 dpkg 锁
+        :param depends_on: 必须先成功的任务，任一失败时本任务直接标记失败
+        :param env: 传给脚本的额外环境变量
+        """
         try:
             mode = os.stat(script_path).st_mode
             os.chmod(script_path, mode | 0o111)
         except Exception:
             pass
 
-        cmd = ["bash", script_path.as_posix()]
+        argv = ["bash", script_path.as_posix()]
+        # 提前检查提权方式，缺少 pkexec/sudo 时直接报错而不是排队后才失败
+        self._command(argv, requires_root, {})
+
+        task = InstallerTask(
+            key=key,
+            log=LogRingBuffer(max_lines=self.settings.log_max_lines, max_bytes=self.settings.log_max_bytes),
+        )
+        task.log.listener = lambda lines: self.events.publish("log", {"key": key, "lines": lines})
+        task.env = dict(env or {})
+        artifacts = [a for a in (artifacts or []) if isinstance(a, dict) and a.get("url")]
+        if artifacts:
+            task.env["APPSTORE_ARTIFACTS_DIR"] = self.prefetcher.task_dir(key).as_posix()
+        try:
+            task.updates_index = script_updates_index(script_path.read_text(encoding="utf-8", errors="replace"))
+        except OSError:
+            pass
+        task.depends_on = list(depends_on or [])
+        task.job = InstallJob(
+            key=key,
+            needs_dpkg_lock=needs_dpkg_lock,
+            run=lambda: self._run_task(task, argv, requires_root),
+            on_error=lambda e: self._abort_task(task, e),
+            depends_on=[dep.job for dep in task.depends_on if dep.job is not None],
+        )
+        self.key_to_task[key] = task
+        self.key_to_task.prune()
+        if artifacts:
+            task.prefetching = True
+            asyncio.create_task(self._prefetch_and_submit(task, artifacts))
+        else:
+            self.scheduler.submit(task.job)
+        if task.job.started_at is None:
+            # 立即开始运行的任务由 _run_task 推送 running 状态
+            self._publish_status(task)
+        return task
+
+    async def _prefetch_and_submit(self, task: InstallerTask, artifacts: List[dict]) -> None:
+        task.progress.mark("prefetch", f"预取 {len(artifacts)} 个安装包")
+        self._publish_progress(task)
+        task.log.append(f"预取 {len(artifacts)} 个安装包...")
+        try:
+            await self.prefetcher.fetch_all(self.http, task.key, artifacts)
+        except Exception as e:
+            task.prefetching = False
+            self._fail_task(task, f"预取安装包失败: {e}")
+            assert task.job is not None
+            self.scheduler.discard(task.job)
+            return
+        task.prefetching = False
+        task.log.append("安装包预取完成，等待安装")
+        assert task.job is not None
+        # 排队等待时间从预取完成算起
+        task.job.enqueued_at = time.monotonic()
+        self.scheduler.submit(task.job)
+        self._publish_status(task)
+
+    def _fail_task(self, task: InstallerTask, message: str) -> None:
+        task.log.append(message)
+        task.return_code = -1
+        task.progress.finish(-1)
+        self._finish_task(task)
+
+    def _abort_task(self, task: InstallerTask, error: Exception) -> None:
+        # 调度器兜底：任务运行中抛出未处理的异常时，还未结束的任务按失败结束
+        if task.done_event.is_set():
+            return
+        if task.return_code is None:
+            self._fail_task(task, f"安装任务异常结束: {error}")
+        else:
+            self._finish_task(task)
+
+    def _finish_task(self, task: InstallerTask) -> None:
+        task.finished_at = time.time()
+        task.log.close()
+        task.done_event.set()
+        # 进程已退出，不再持有进程对象
+        task.process = None
+        self._publish_status(task)
+        asyncio.create_task(self._persist_task(task))
+        asyncio.create_task(self._refresh_installed(task.key))
+        # 删除任务目录中的制品链接，缓存超出上限时按最近使用淘汰
+        asyncio.create_task(asyncio.to_thread(self.prefetcher.release, task.key))
+        self.key_to_task.prune()
+
+    async def _refresh_installed(self, key: str) -> None:
+        # 安装结束后重新检测这一个软件，把结果作为增量推送，页面无需重新拉取整个列表
+        self.invalidate_installed(key)
+        self._installed_known.pop(key, None)
+        installed = await self.check_installed_async(key, self._check_commands.get(key))
+        self.events.publish("installed", {"key": key, "installed": installed})
+
+    def _publish_status(self, task: InstallerTask) -> None:
+        status = self.get_status(task.key)
+        if status is not None and self.key_to_task.get(task.key) is task:
+            self.events.publish("status", status)
+
+    def _publish_progress(self, task: InstallerTask) -> None:
+        self.events.publish("progress", dict(task.progress.snapshot(), key=task.key))
+
+    async def stream_events(
+        self, last_event_id: Optional[str] = None
+    ) -> AsyncGenerator[Tuple[str, Optional[str], Optional[dict]], None]:
+        """
+        所有任务的事件流：log / progress / status / installed
+        新连接（或事件已被丢弃、ID 来自之前的进程需要重新同步时）先收到 snapshot，包含当前全部任务的状态
+        :param last_event_id: 已收到的最后一个事件的 ID（SSE Last-Event-ID）
+        """
+        after: Optional[int] = None
+        if not last_event_id:
+            # 先确定起点再生成快照，快照之后发生的事件都不会漏掉
+            after = self.events.last_seq
+            yield "snapshot", None, self._snapshot()
+        async for kind, event_id, payload in self.events.stream(last_event_id, self.settings.log_flush_interval, after):
+            if kind == "reset":
+                yield "snapshot", None, self._snapshot()
+                continue
+            yield kind, event_id, payload
+
+    def _snapshot(self) -> dict:
+        return {"tasks": [status for status in (self.get_status(key) for key in self.key_to_task) if status]}
+
+    async def _persist_task(self, task: InstallerTask) -> None:
+        lines, _, _ = task.log.read(task.log.first_seq)
+        try:
+            record = await asyncio.to_thread(
+                self.history.record,
+                task.key,
+                task.created_at,
+                task.finished_at or time.time(),
+                task.return_code,
+                lines,
+                task.log.first_seq,
+            )
+        except Exception as e:
+            logger.warning("failed to persist install log for %s: %s", task.key, e)
+            return
+        task.history_id = str(record["id"])
+
+    async def _run_task(self, task: InstallerTask, argv: List[str], requires_root: bool) -> None:
+        failed = [dep.key for dep in task.depends_on if dep.return_code != 0]
+        if failed:
+            self._fail_task(task, f"依赖 {', '.join(failed)} 未安装成功，跳过")
+            return
+        # 启动进程之前的任何异常（提权方式缺失、写 APT 配置失败等）都必须结束任务，
+        # 否则任务离开调度器后仍处于运行状态，日志流挂起，同一 key 也无法再次安装
+        try:
+            if task.updates_index and self.apt_index.ttl > 0:
+                # 在本任务持有 dpkg 锁期间刷新，不会与其他 apt 操作冲突
+                await self.refresh_apt_index(task.log.extend, requires_root)
+            env = self._build_env(task.env)
+            task.process = await asyncio.create_subprocess_exec(
+                *self._command(argv, requires_root, env),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=str(self.settings.scripts_dir),
+                env=env,
+            )
+        except Exception as e:
+            self._fail_task(task, f"启动安装进程失败: {e}")
+            return
+        self._publish_status(task)
+
+        pump = asyncio.create_task(self._pump_output(task))
+        await self._wait_return_code(task, pump)
+
+    async def refresh_apt_index(
+        self, log: Optional[Callable[[List[str]], None]] = None, requires_root: bool = True
+    ) -> bool:
+        """
+        按 TTL 刷新 apt 索引，并发调用者共享同一次刷新
+        无法提权时不刷新，返回 False，由脚本自己的 apt-get update 兜底
+        """
+        log = log or (lambda lines: None)
+        try:
+            command = self._command(["apt-get", "update"], requires_root, {})
+        except InstallStartError as e:
+            log([f"跳过 apt 索引刷新: {e}"])
+            return False
+        return await self.apt_index.ensure_fresh(command, log)
+
+    async def refresh_apt_index_now(self) -> bool:
+        """
+        手动刷新 apt 索引：作为持有 dpkg 锁的任务进入调度队列，不会与正在运行的 apt/dpkg 脚本并发；
+        多次请求共享同一个排队中的刷新
+        """
+        if self.apt_index.is_fresh():
+            return True
+        # 提前检查提权方式，缺少 pkexec/sudo 时直接报错而不是排队后才失败
+        self._command(["apt-get", "update"], True, {})
+        if self._apt_refresh is None:
+            future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+            async def run() -> None:
+                try:
+                    future.set_result(await self.refresh_apt_index())
+                except Exception as e:
+                    future.set_exception(e)
+
+            self._apt_refresh = future
+            future.add_done_callback(lambda _: setattr(self, "_apt_refresh", None))
+            self.scheduler.submit(InstallJob(key=APT_REFRESH_JOB, needs_dpkg_lock=True, run=run))
+        return await asyncio.shield(self._apt_refresh)
+
+    def _command(self, argv: List[str], requires_root: bool, env: Dict[str, str]) -> List[str]:
+        cmd = list(argv)
+        script_env = {
+            name: value for name, value in env.items() if name.startswith("APPSTORE_") or name in FORWARDED_ENV
+        }
+        if script_env:
+            # 通过 env 命令传入而不是进程环境：pkexec 会清空调用方的环境变量
+            cmd = ["env"] + [f"{name}={value}" for name, value in script_env.items()] + cmd
 
         use_pkexec = requires_root and platform.system() == "Linux"
         if use_pkexec:
@@ -138,73 +736,167 @@ class InstallerManager:
                 cmd = ["sudo", "-E", "-S"] + cmd
             else:
                 raise InstallStartError("no pkexec or sudo available for privilege escalation")
+        return cmd
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-            cwd=str(self.settings.scripts_dir),
-            env=self._build_env(),
-        )
-
-        task = InstallerTask(key=key, process=process)
-        self.key_to_task[key] = task
-
-        asyncio.create_task(self._pump_output(task))
-        asyncio.create_task(self._wait_return_code(task))
-
-        return key
-
+    def _needs_dpkg_lock(self, data: dict, script_path: Path) -> bool:
+        # 优先使用元数据中的 dpkgLock 声明，未声明时扫描脚本内容
+        declared = data.get("dpkgLock")
+        if isinstance(declared, bool):
+            return declared
+        try:
+            return script_needs_dpkg_lock(script_path.read_text(encoding="utf-8", errors="replace"))
+        except OSError:
+            return True
 
     def get_status(self, key: str) -> Optional[dict]:
         task = self.key_to_task.get(key)
         if not task:
-            return None
+            # 已从内存淘汰的任务，从安装历史中取最后一次的结果
+            record = self.history.latest(key)
+            if record is None:
+                return None
+            return {
+                "key": key,
+                "running": False,
+                "state": "finished",
+                "queuePosition": None,
+                "waitSeconds": 0.0,
+                "returnCode": record.get("returnCode"),
+                "progress": None,
+                "historyId": record.get("id"),
+            }
+        job = task.job
+        if task.prefetching:
+            state = "prefetching"
+        elif task.return_code is not None:
+            state = "finished"
+        elif job:
+            state = job.state
+        else:
+            state = "finished" if task.return_code is not None else "running"
         return {
             "key": key,
             "running": task.return_code is None,
+            "state": state,
+            "queuePosition": self.scheduler.queue_position(key),
+            "waitSeconds": round(job.wait_seconds, 3) if job and not task.prefetching else 0.0,
             "returnCode": task.return_code,
+            "progress": task.progress.snapshot(),
+            "historyId": task.history_id,
         }
 
-    async def stream_output(self, key: str) -> AsyncGenerator[str, None]:
+    async def stream_output(
+        self, key: str, last_event_id: Optional[str] = None
+    ) -> AsyncGenerator[Tuple[str, Optional[str], object], None]:
+        """
+        按批输出安装日志与进度，只在有新输出、进度变化或进程结束时被唤醒；
+        唤醒后再等一个短的合并窗口，把这段时间内的多行合成一批
+        :param last_event_id: SSE Last-Event-ID，属于本次任务时从其后一行继续；
+                              为空或来自同一 key 之前的任务时从缓冲区最早一行开始
+        :return: ("log", 本批最后一行的事件 ID, 行列表) 或 ("progress", None, 进度快照)；
+                 日志批次的事件 ID 为 None 表示只有提示信息（如行被丢弃）
+        """
         task = self.key_to_task.get(key)
         if not task:
             return
-        # Drain existing buffered lines first
-        while not task.buffer.empty():
-            yield await task.buffer.get()
-        # Then continue streaming
-        while task.return_code is None or not task.buffer.empty():
-            try:
-                line = await asyncio.wait_for(task.buffer.get(), timeout=0.5)
-                yield line
-            except asyncio.TimeoutError:
-                if task.return_code is not None and task.buffer.empty():
-                    break
+        # 晚到的读者从缓冲区中仍保留的最早一行开始，也能看到之前的输出
+        after = task.log.parse_event_id(last_event_id)
+        cursor = task.log.first_seq if after is None else after + 1
+        progress_version = 0
+        while True:
+            lines, end, dropped = task.log.read(cursor, limit=LOG_BATCH_MAX_LINES)
+            batch = ([f"[... 省略 {dropped} 行 ...]"] if dropped else []) + lines
+            if batch:
+                yield "log", (task.log.event_id(end - 1) if lines else None), batch
+            cursor = end
+            if task.progress.version != progress_version:
+                progress_version = task.progress.version
+                yield "progress", None, task.progress.snapshot()
+            if task.log.closed and cursor >= task.log.next_seq:
+                break
+            if cursor < task.log.next_seq:
+                continue
+            await task.log.wait(cursor)
+            if not task.log.closed:
+                await asyncio.sleep(self.settings.log_flush_interval)
 
     async def _pump_output(self, task: InstallerTask) -> None:
-        assert task.process.stdout is not None
+        assert task.process is not None and task.process.stdout is not None
+        # 按块读取而不是 readline：超长行不会触发 StreamReader 的 64 KiB 限制，系统调用也更少
+        assembler = LineAssembler()
         while True:
-            line = await task.process.stdout.readline()
-            if not line:
+            chunk = await task.process.stdout.read(OUTPUT_CHUNK_SIZE)
+            if not chunk:
                 break
-            # asyncio subprocess 返回 bytes，需要解码为 str
-            try:
-                text = line.decode(errors="replace")
-            except Exception:
-                text = str(line)
-            await task.buffer.put(text.rstrip("\n"))
-
-    async def _wait_return_code(self, task: InstallerTask) -> None:
+            self._publish_output(task, assembler.feed(chunk))
+        self._publish_output(task, assembler.flush())
+
+    def _publish_output(self, task: InstallerTask, lines: List[str]) -> None:
+        visible: List[str] = []
+        changed = False
+        for line in lines:
+            changed = task.progress.feed(line) or changed
+            # APT::Status-Fd 的状态行只用于解析进度，不进入日志
+            if not line.startswith(STATUS_PREFIXES):
+                visible.append(line)
+        task.log.extend(visible)
+        if changed:
+            self._publish_progress(task)
+            if not visible:
+                task.log.notify()
+
+    async def _wait_return_code(self, task: InstallerTask, pump: asyncio.Task) -> None:
+        assert task.process is not None
         rc = await task.process.wait()
         task.return_code = rc
-        task.done_event.set()
-
-    def _build_env(self) -> dict:
+        task.progress.finish(rc)
+        # 安装结束后该软件的安装状态可能变化，丢弃缓存
+        self.invalidate_installed(task.key)
+        # 等输出读完再关闭日志；脚本拉起的后台进程可能一直占着 stdout，最多等几秒
+        await asyncio.wait({pump}, timeout=3)
+        self._finish_task(task)
+
+    def _build_env(self, extra: Optional[Dict[str, str]] = None) -> dict:
         env = os.environ.copy()
+        env.update(extra or {})
         env.setdefault("DEBIAN_FRONTEND", "noninteractive")
+        # apt 索引新鲜度约定：APPSTORE_APT_INDEX_FRESH=1 时脚本可跳过 apt-get update
+        env["APPSTORE_APT_INDEX_TTL"] = str(int(self.apt_index.ttl))
+        if self.apt_index.is_fresh():
+            env[FRESH_ENV] = "1"
+            env["APPSTORE_APT_UPDATED_AT"] = str(int(self.apt_index.refreshed_at or 0))
+        if self.settings.apt_status_fd:
+            # 让脚本里的 apt-get 把机器可读的进度（dlstatus/pmstatus）写到 stdout，供进度解析使用
+            env.setdefault("APT_CONFIG", self._apt_status_config().as_posix())
         return env
 
+    def _apt_status_config(self) -> Path:
+        path = self.settings.scripts_dir / ".apt" / "status-fd.conf"
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text('APT::Status-Fd "1";\n', encoding="utf-8")
+        return path
+
+
+async def _run_check_command(check_command: str, timeout: float) -> bool:
+    try:
+        process = await asyncio.create_subprocess_shell(
+            check_command,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except Exception:
+        return False
+    try:
+        return await asyncio.wait_for(process.wait(), timeout=timeout) == 0
+    except asyncio.TimeoutError:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        return False
+
 
 def _detect_os_id() -> str:
     try:
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+class LogRingBuffer:
+    """
+    安装输出的有界环形缓冲区，同时限制行数与字节数
+    每行带单调递增的序号，读者各自持有游标（下一个要读的序号），互不影响；
+    追加一行只做 O(1) 的写入与一次唤醒，可以同时服务任意数量的读者
+    """
+
+    def __init__(self, max_lines: int = 5000, max_bytes: int = 1024 * 1024):
+        self.max_lines = max(1, max_lines)
+        self.max_bytes = max_bytes
+        self._slots: List[Optional[str]] = [None] * self.max_lines
+        self._sizes: List[int] = [0] * self.max_lines
+        # 保留的序号区间为 [first_seq, next_seq)
+        self.first_seq = 0
+        self.next_seq = 0
+        self.total_bytes = 0
+        self.closed = False
+        self._event = asyncio.Event()
+        # 新行的订阅者（如汇总所有任务的事件流），在写入后同步调用
+        self.listener: Optional[Callable[[List[str]], None]] = None
+        # 缓冲区的纪元：序号只在同一个缓冲区内有意义，新任务或进程重启后旧的序号不能直接续传
+        self.epoch = str(time.time_ns())
+
+    def event_id(self, seq: int) -> str:
+        """SSE 事件 ID：<纪元>-<序号>"""
+        return f"{self.epoch}-{seq}"
+
+    def parse_event_id(self, value: Optional[str]) -> Optional[int]:
+        """解析 Last-Event-ID，返回序号；为空、格式不符或来自其他缓冲区（纪元不同）时返回 None"""
+        epoch, sep, seq = (value or "").partition("-")
+        if not sep or epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def append(self, line: str) -> int:
+        seq = self._append(line)
+        self._notify()
+        if self.listener is not None:
+            self.listener([line])
+        return seq
+
+    def extend(self, lines: List[str]) -> None:
+        # 批量追加，只唤醒一次读者
+        if not lines:
+            return
+        for line in lines:
+            self._append(line)
+        self._notify()
+        if self.listener is not None:
+            self.listener(lines)
+
+    def _append(self, line: str) -> int:
+        seq = self.next_seq
+        if seq - self.first_seq >= self.max_lines:
+            self._drop_oldest()
+        idx = seq % self.max_lines
+        size = len(line.encode("utf-8", errors="replace"))
+        self._slots[idx] = line
+        self._sizes[idx] = size
+        self.total_bytes += size
+        self.next_seq = seq + 1
+        while self.total_bytes > self.max_bytes and self.next_seq - self.first_seq > 1:
+            self._drop_oldest()
+        return seq
+
+    def close(self) -> None:
+        self.closed = True
+        self._notify()
+
+    def notify(self) -> None:
+        """没有新行但状态有变化（如进度更新）时唤醒读者"""
+        self._notify()
+
+    def read(self, cursor: int, limit: Optional[int] = None) -> Tuple[List[str], int, int]:
+        """
+        从游标处读取已有的行
+        :return: (行列表, 新游标, 因超出容量被丢弃而跳过的行数)
+        """
+        dropped = 0
+        if cursor < self.first_seq:
+            dropped = self.first_seq - cursor
+            cursor = self.first_seq
+        end = self.next_seq if limit is None else min(self.next_seq, cursor + limit)
+        end = max(end, cursor)
+        lines = [self._slots[seq % self.max_lines] or "" for seq in range(cursor, end)]
+        return lines, end, dropped
+
+    async def wait(self, cursor: int, timeout: Optional[float] = None) -> None:
+        """等待游标之后出现新行或缓冲区关闭"""
+        if cursor < self.next_seq or self.closed:
+            return
+        event = self._event
+        if timeout is None:
+            await event.wait()
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _drop_oldest(self) -> None:
+        idx = self.first_seq % self.max_lines
+        self.total_bytes -= self._sizes[idx]
+        self._slots[idx] = None
+        self._sizes[idx] = 0
+        self.first_seq += 1
+
+    def _notify(self) -> None:
+        # 唤醒当前所有等待者，并换上新的 Event 供后续等待
+        self._event.set()
+        self._event = asyncio.Event()
+
+
+class LineAssembler:
+    """
+    把子进程的原始输出块拼成行
+    - \r 重绘的进度（wget/apt）只保留最后一次的状态
+    - 尚未换行的进度行最多每 progress_interval 秒输出一次当前状态
+    - 按增量解码，多字节字符跨块也不会被截断
+    """
+
+    def __init__(self, progress_interval: float = 1.0):
+        self.progress_interval = progress_interval
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+        self._last_progress = 0.0
+
+    def feed(self, chunk: bytes) -> List[str]:
+        text = self._pending + self._decoder.decode(chunk)
+        parts = text.split("\n")
+        self._pending = parts.pop()
+        lines = [_collapse_cr(part) for part in parts]
+
+        # 未完成的行里出现 \r 说明在刷新进度，只保留最新状态并限频输出
+        if "\r" in self._pending:
+            self._pending = _collapse_cr(self._pending)
+            now = time.monotonic()
+            if self._pending and now - self._last_progress >= self.progress_interval:
+                self._last_progress = now
+                lines.append(self._pending)
+                self._pending = ""
+        return lines
+
+    def flush(self) -> List[str]:
+        text = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        return [_collapse_cr(text)] if text else []
+
+
+def _collapse_cr(line: str) -> str:
+    if "\r" not in line:
+        return line
+    segments = [seg for seg in line.split("\r") if seg]
+    return segments[-1] if segments else ""
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+# 未声明 sha256 的制品复用前与上游比较的响应头
+VALIDATOR_HEADERS = ("etag", "last-modified", "content-length")
+# 请求原始内容，Content-Length 与落盘的文件大小一致
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class ArtifactPrefetcher:
+    """
+    安装前并发预取元数据中声明的制品（artifacts）
+    - 缓存文件按 sha256 命名，已存在时直接复用；未声明 sha256 的按 URL 哈希缓存，
+      复用前用 HEAD 比较上游的 ETag / Last-Modified / Content-Length，不一致时重新下载
+    - 同一制品的并发请求只下载一次
+    - 下载写临时文件，校验通过后 rename，安装脚本不会读到半个文件
+    - 任务结束后删除其链接目录；缓存总大小超过 max_bytes 时按最近使用时间淘汰，仍被任务引用的文件保留
+    """
+
+    def __init__(self, root: Path, concurrency: int = 4, max_bytes: int = 4 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.cache_dir = root / "cache"
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def task_dir(self, key: str) -> Path:
+        return self.root / "tasks" / key
+
+    async def fetch_all(self, http: httpx.AsyncClient, key: str, artifacts: List[dict]) -> Path:
+        """
+        下载 key 声明的全部制品，并在任务目录下按 name 建立指向缓存文件的链接
+        :return: 任务目录，安装时通过 APPSTORE_ARTIFACTS_DIR 传给脚本
+        """
+        dest = self.task_dir(key)
+        dest.mkdir(parents=True, exist_ok=True)
+        paths = await asyncio.gather(*(self._ensure(http, a) for a in artifacts))
+        for artifact, path in zip(artifacts, paths):
+            link = dest / _artifact_name(artifact)
+            tmp = link.with_name(f".{link.name}.tmp")
+            tmp.unlink(missing_ok=True)
+            tmp.symlink_to(path)
+            os.replace(tmp, link)
+        await asyncio.to_thread(self.evict)
+        return dest
+
+    def release(self, key: str) -> None:
+        """任务结束：删除任务目录（只有指向缓存的链接），然后检查缓存上限"""
+        shutil.rmtree(self.task_dir(key), ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        try:
+            entries = [
+                e for e in os.scandir(self.cache_dir)
+                if e.is_file() and not e.name.startswith(".tmp-") and not e.name.endswith(".meta")
+            ]
+        except OSError:
+            return
+        files = []
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        in_use = self._in_use()
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if os.path.realpath(path) in in_use:
+                continue
+            try:
+                os.unlink(path)
+                total -= size
+                _meta_path(Path(path)).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning("failed to evict artifact %s: %s", path, e)
+
+    def _in_use(self) -> set:
+        # 尚未结束的任务目录中的链接目标
+        targets = set()
+        try:
+            task_dirs = list(os.scandir(self.root / "tasks"))
+        except OSError:
+            return targets
+        for task_dir in task_dirs:
+            try:
+                for link in os.scandir(task_dir.path):
+                    targets.add(os.path.realpath(link.path))
+            except OSError:
+                continue
+        return targets
+
+    async def _ensure(self, http: httpx.AsyncClient, artifact: dict) -> Path:
+        url = artifact.get("url")
+        if not url:
+            raise ArtifactError("制品缺少 url")
+        expected = (artifact.get("sha256") or "").lower() or None
+        cache_key = f"sha256-{expected}" if expected else f"url-{hashlib.sha256(url.encode('utf-8')).hexdigest()}"
+        path = self.cache_dir / cache_key
+        if path.is_file() and (expected or await self._revalidate(http, url, path)):
+            # 以 mtime 记录最近使用时间，淘汰时先删最久未用的
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(self._download(http, url, expected, path))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return await asyncio.shield(task)
+
+    async def _revalidate(self, http: httpx.AsyncClient, url: str, path: Path) -> bool:
+        """
+        未声明 sha256 的缓存没有可校验的内容哈希：与下载时记录的上游校验头比较，确认上游文件未变化
+        上游不可达时继续使用缓存（离线安装），没有记录或校验头不一致时返回 False 重新下载
+        """
+        stored = _read_validators(path)
+        if not stored:
+            return False
+        if "content-length" in stored and str(path.stat().st_size) != stored["content-length"]:
+            return False
+        try:
+            resp = await http.head(
+                url, headers=IDENTITY, timeout=httpx.Timeout(15.0, connect=5.0), follow_redirects=True
+            )
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning("cannot revalidate artifact %s, using cached copy: %s", url, e)
+            return True
+        current = _validators(resp.headers)
+        common = [name for name in stored if name in current]
+        return bool(common) and all(stored[name] == current[name] for name in common)
+
+    async def _download(self, http: httpx.AsyncClient, url: str, expected: Optional[str], path: Path) -> Path:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        async with self._semaphore:
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+            hasher = hashlib.sha256()
+            validators: Dict[str, str] = {}
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    async with http.stream(
+                        "GET", url, headers=IDENTITY, timeout=httpx.Timeout(60.0, connect=10.0), follow_redirects=True
+                    ) as resp:
+                        resp.raise_for_status()
+                        validators = _validators(resp.headers)
+                        async for chunk in resp.aiter_bytes(256 * 1024):
+                            hasher.update(chunk)
+                            f.write(chunk)
+                actual = hasher.hexdigest()
+                if expected and actual != expected:
+                    raise ArtifactError(f"制品校验失败: {url} 期望 sha256 {expected}, 实际 {actual}")
+                os.replace(tmp_name, path)
+                if not expected:
+                    logger.warning("artifact %s has no sha256 in metadata, download not verified", url)
+                    _write_validators(path, validators)
+            except httpx.HTTPError as e:
+                os.unlink(tmp_name)
+                raise ArtifactError(f"下载制品失败: {url}: {e}")
+            except BaseException:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+                raise
+        return path
+
+
+def _artifact_name(artifact: dict) -> str:
+    name = artifact.get("name") or artifact["url"].rstrip("/").split("/")[-1].split("?")[0]
+    # 只取文件名，避免 ../ 之类的路径逃逸
+    name = Path(name).name
+    if not name or name in (".", ".."):
+        raise ArtifactError(f"无效的制品名称: {artifact.get('name')}")
+    return name
+
+
+def _meta_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.meta")
+
+
+def _validators(headers: httpx.Headers) -> Dict[str, str]:
+    return {name: headers[name] for name in VALIDATOR_HEADERS if name in headers}
+
+
+def _read_validators(path: Path) -> Dict[str, str]:
+    try:
+        data = json.loads(_meta_path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_validators(path: Path, validators: Dict[str, str]) -> None:
+    try:
+        _meta_path(path).write_text(json.dumps(validators), encoding="utf-8")
+    except OSError as e:
+        logger.warning("failed to save validators for %s: %s", path, e)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import re
+import time
+from typing import Dict, Optional
+
+
+# APT::Status-Fd 输出，例如 "dlstatus:1:10.5:Retrieving file 1 of 3"、"pmstatus:vlc:45.0:Unpacking vlc"
+_APT_STATUS = re.compile(r"^(dlstatus|pmstatus|pmerror|pmconffile|media-change):([^:]*):([\d.]+)?:?(.*)$")
+_APT_GET = re.compile(r"^Get:\d+\s+\S+\s+.*?(\S+)\s+\S+\s+\S+\s+\[([\d.,]+)\s*([kMG]?B)\]")
+_APT_NEED = re.compile(r"^Need to get (?:[\d.,]+\s*[kMG]?B/)?([\d.,]+)\s*([kMG]?B)")
+_APT_FETCHED = re.compile(r"^Fetched ([\d.,]+)\s*([kMG]?B) in")
+_DPKG_UNPACK = re.compile(r"^Unpacking (\S+)")
+_DPKG_SETUP = re.compile(r"^Setting up (\S+)")
+_DPKG_TRIGGERS = re.compile(r"^Processing triggers for (\S+)")
+_APT_RESOLVE = re.compile(r"^(Reading package lists|Building dependency tree|Reading state information)")
+# wget 进度：" 45%[=====>    ]  12.3M  1.2MB/s    eta 10s" 或点格式 "  1000K .......... 45% 1.2M 10s"
+_WGET_PERCENT = re.compile(r"(\d{1,3})%\s*(?:\[[^\]]*\])?\s*([\d.,]+[KMG]?)?")
+_WGET_ETA = re.compile(r"eta\s+((?:\d+[hms]\s*)+)")
+_WGET_SIZE = re.compile(r"^\s*([\d.,]+[KMG]?)\s")
+_DURATION = re.compile(r"(\d+)([hms])")
+
+_UNITS = {"B": 1, "kB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+# 这些行是给解析器看的，不写入日志
+STATUS_PREFIXES = ("dlstatus:", "pmstatus:", "pmerror:", "pmconffile:", "media-change:")
+
+
+class ProgressTracker:
+    """
+    从 apt/dpkg/wget 输出中解析结构化的安装进度，并统计各阶段耗时
+    阶段：prefetch（安装前预取）/ resolve（依赖计算）/ download / unpack / setup / triggers / done
+    """
+
+    def __init__(self) -> None:
+        self.phase: Optional[str] = None
+        self.percent: Optional[float] = None
+        self.bytes: Optional[int] = None
+        self.total_bytes: Optional[int] = None
+        self.eta: Optional[int] = None
+        self.package: Optional[str] = None
+        self.message: str = ""
+        # 每次更新递增，读者据此判断是否需要推送
+        self.version = 0
+        self._phase_started: Optional[float] = None
+        self.phase_durations: Dict[str, float] = {}
+
+    def feed(self, line: str) -> bool:
+        """解析一行输出，进度有变化时返回 True"""
+        text = line.strip()
+        if not text:
+            return False
+
+        m = _APT_STATUS.match(text)
+        if m:
+            kind, pkg, percent, message = m.groups()
+            if kind == "dlstatus":
+                return self._update("download", percent=_float(percent), message=message)
+            if kind == "pmstatus":
+                phase = "setup" if message.startswith(("Configuring", "Installed")) else "unpack"
+                return self._update(phase, percent=_float(percent), package=pkg or None, message=message)
+            if kind == "pmerror":
+                return self._update(self.phase or "setup", package=pkg or None, message=f"error: {message}")
+            return False
+
+        m = _APT_NEED.match(text)
+        if m:
+            return self._update("download", total_bytes=_size(m.group(1), m.group(2)), bytes=0, message=text)
+        m = _APT_GET.match(text)
+        if m:
+            done = (self.bytes or 0) + _size(m.group(2), m.group(3))
+            percent = done * 100.0 / self.total_bytes if self.total_bytes else None
+            return self._update("download", bytes=done, percent=percent, package=m.group(1), message=text)
+        m = _APT_FETCHED.match(text)
+        if m:
+            return self._update("download", bytes=_size(m.group(1), m.group(2)), percent=100.0, message=text)
+        m = _DPKG_UNPACK.match(text)
+        if m:
+            return self._update("unpack", package=m.group(1), message=text)
+        m = _DPKG_SETUP.match(text)
+        if m:
+            return self._update("setup", package=m.group(1), message=text)
+        m = _DPKG_TRIGGERS.match(text)
+        if m:
+            return self._update("triggers", package=m.group(1), message=text)
+        if _APT_RESOLVE.match(text):
+            return self._update("resolve", message=text)
+
+        m = _WGET_PERCENT.search(text)
+        if m and ("eta" in text or "/s" in text or "...." in text):
+            eta = _WGET_ETA.search(text)
+            size = _WGET_SIZE.match(text)
+            downloaded = m.group(2) or (size.group(1) if size else None)
+            return self._update(
+                "download",
+                percent=float(m.group(1)),
+                bytes=_size(downloaded, "") if downloaded else None,
+                eta=_duration(eta.group(1)) if eta else None,
+                message=text,
+            )
+        return False
+
+    def mark(self, phase: str, message: str = "") -> None:
+        """由安装器直接设置阶段（如 prefetch），不来自脚本输出"""
+        self._update(phase, message=message)
+
+    def finish(self, return_code: int) -> None:
+        self._update("done", percent=100.0 if return_code == 0 else self.percent, message=f"exit {return_code}")
+
+    def snapshot(self) -> Dict[str, object]:
+        durations = dict(self.phase_durations)
+        if self.phase and self.phase != "done" and self._phase_started is not None:
+            durations[self.phase] = durations.get(self.phase, 0.0) + time.monotonic() - self._phase_started
+        return {
+            "phase": self.phase,
+            "percent": self.percent,
+            "bytes": self.bytes,
+            "totalBytes": self.total_bytes,
+            "eta": self.eta,
+            "package": self.package,
+            "message": self.message,
+            "phaseDurations": {k: round(v, 3) for k, v in durations.items()},
+        }
+
+    def _update(self, phase: str, **fields: object) -> bool:
+        now = time.monotonic()
+        if phase != self.phase:
+            if self.phase is not None and self._phase_started is not None:
+                self.phase_durations[self.phase] = self.phase_durations.get(self.phase, 0.0) + now - self._phase_started
+            self.phase = phase
+            self._phase_started = now
+            # 进入新阶段时清掉上个阶段的数值
+            self.percent = self.eta = self.bytes = self.total_bytes = None
+        for name, value in fields.items():
+            # 百分比与剩余时间以最新一行为准，其余字段缺失时保留原值
+            if value is not None or name in ("percent", "eta"):
+                setattr(self, name, value)
+        self.version += 1
+        return True
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _size(number: str, unit: str) -> int:
+    number = number.replace(",", "")
+    if number and number[-1] in "KMG":
+        number, unit = number[:-1], number[-1]
+    try:
+        return int(float(number) * _UNITS.get(unit, 1))
+    except ValueError:
+        return 0
+
+
+def _duration(value: str) -> int:
+    factors = {"h": 3600, "m": 60, "s": 1}
+    return sum(int(n) * factors[u] for n, u in _DURATION.findall(value))
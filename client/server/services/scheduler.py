@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# 脚本中出现这些命令即认为需要 dpkg 锁
+_DPKG_COMMANDS = re.compile(r"(^|[\s;&|(`])(apt-get|apt|aptitude|dpkg|gdebi)\s", re.MULTILINE)
+
+
+def script_needs_dpkg_lock(content: str) -> bool:
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            continue
+        if _DPKG_COMMANDS.search(stripped):
+            return True
+    return False
+
+
+@dataclass(eq=False)
+class InstallJob:
+    key: str
+    needs_dpkg_lock: bool
+    run: Callable[[], Awaitable[None]]
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # 必须先结束的任务（套装内的依赖），结束前本任务不会被调度
+    depends_on: List["InstallJob"] = field(default_factory=list)
+    # run 抛出异常时调用，负责结束对应的任务，保证任务不会在离开调度器后仍处于运行状态
+    on_error: Optional[Callable[[Exception], None]] = None
+
+    @property
+    def ready(self) -> bool:
+        return all(dep.finished_at is not None for dep in self.depends_on)
+
+    @property
+    def state(self) -> str:
+        if self.finished_at is not None:
+            return "finished"
+        if self.started_at is not None:
+            return "running"
+        return "queued"
+
+    @property
+    def wait_seconds(self) -> float:
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+
+class InstallScheduler:
+    """
+    安装任务调度：FIFO 队列 + 并发上限
+    需要 dpkg 锁的任务（apt/dpkg）同一时间只运行一个，彼此保持先来先服务；
+    不需要锁的任务（下载、解压 tar 包等）可越过等锁的任务并行执行
+    """
+
+    def __init__(self, max_concurrency: int = 3):
+        self.max_concurrency = max(1, max_concurrency)
+        self._queue: Deque[InstallJob] = deque()
+        self._running: Dict[str, InstallJob] = {}
+        self._dpkg_holder: Optional[str] = None
+
+    def submit(self, job: InstallJob) -> None:
+        self._queue.append(job)
+        self._dispatch()
+
+    def discard(self, job: InstallJob) -> None:
+        """未启动就失败的任务（如预取失败）直接标记为结束，让依赖它的任务继续调度"""
+        if job in self._queue:
+            self._queue.remove(job)
+        if job.started_at is None:
+            job.finished_at = time.monotonic()
+        self._dispatch()
+
+    def queue_position(self, key: str) -> Optional[int]:
+        """排队中的位置（从 1 开始），不在队列中返回 None"""
+        for index, job in enumerate(self._queue):
+            if job.key == key:
+                return index + 1
+        return None
+
+    def _dispatch(self) -> None:
+        if not self._queue:
+            return
+        lock_requested = False
+        for job in list(self._queue):
+            if len(self._running) >= self.max_concurrency:
+                break
+            if not job.ready:
+                # 等依赖的任务先跑完，不占用锁的排队资格
+                continue
+            if job.needs_dpkg_lock:
+                # 只有排在最前面的等锁任务有资格拿锁，保证锁的 FIFO 顺序
+                if self._dpkg_holder is not None or lock_requested:
+                    lock_requested = True
+                    continue
+                lock_requested = True
+                self._dpkg_holder = job.key
+            self._queue.remove(job)
+            self._start(job)
+
+    def _start(self, job: InstallJob) -> None:
+        job.started_at = time.monotonic()
+        self._running[job.key] = job
+        asyncio.create_task(self._run(job))
+
+    async def _run(self, job: InstallJob) -> None:
+        try:
+            await job.run()
+        except Exception as e:
+            logger.exception("install job %s failed", job.key)
+            if job.on_error is not None:
+                try:
+                    job.on_error(e)
+                except Exception:
+                    logger.exception("failed to finish install job %s", job.key)
+        finally:
+            job.finished_at = time.monotonic()
+            self._running.pop(job.key, None)
+            if self._dpkg_holder == job.key:
+                self._dpkg_holder = None
+            self._dispatch()
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class ScriptHashMismatch(Exception):
+    pass
+
+
+def sha256_of(content: bytes) -> str:
+    return f"sha256:{hashlib.sha256(content).hexdigest()}"
+
+
+class ScriptCache:
+    """
+    按内容哈希存放的安装脚本缓存：<root>/sha256-<hex>.sh
+    文件一旦写入就不再修改，写入走临时文件 + rename，并发安装不会执行到写了一半的脚本
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path_for(self, script_hash: str) -> Optional[Path]:
+        algo, _, digest = script_hash.partition(":")
+        if algo != "sha256" or len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None
+        return self.root / f"sha256-{digest}.sh"
+
+    def get(self, script_hash: Optional[str]) -> Optional[Path]:
+        if not script_hash:
+            return None
+        path = self.path_for(script_hash)
+        if path is not None and path.is_file():
+            return path
+        return None
+
+    def put(self, content: bytes, expected_hash: Optional[str] = None) -> Path:
+        actual = sha256_of(content)
+        if expected_hash and expected_hash != actual:
+            raise ScriptHashMismatch(f"脚本哈希不匹配: 期望 {expected_hash}, 实际 {actual}")
+        path = self.path_for(actual)
+        assert path is not None
+        if path.is_file():
+            return path
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".sh")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_name, 0o755)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+        return path
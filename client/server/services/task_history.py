@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# 每个压缩块包含的行数；块是独立的 gzip member，读取尾部时只解压最后几块
+BLOCK_LINES = 1000
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class InstallHistory:
+    """
+    已结束安装任务的持久化记录：<root>/<id>.json 为元数据，<id>.log.gz 为日志
+    日志由多个独立的 gzip member 组成（标准 gzip 工具可直接读取），元数据中记录每块的偏移与起始行号，
+    分页与 tail 读取只解压需要的块，不会把整个日志读入内存
+    """
+
+    def __init__(self, root: Path, max_records: int = 500):
+        self.root = root
+        self.max_records = max(1, max_records)
+        # 按结束时间升序的元数据（不含块索引），启动时从磁盘恢复
+        self._records: List[Dict[str, object]] = []
+        self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        records = []
+        try:
+            paths = list(self.root.glob("*.json"))
+        except OSError:
+            paths = []
+        for path in paths:
+            try:
+                records.append(_summary(json.loads(path.read_text(encoding="utf-8"))))
+            except (OSError, ValueError):
+                continue
+        records.sort(key=lambda r: r.get("finishedAt") or 0)
+        self._records = records
+        self._evict()
+
+    def record(
+        self,
+        key: str,
+        started_at: float,
+        finished_at: float,
+        return_code: Optional[int],
+        lines: Iterable[str],
+        dropped_lines: int = 0,
+    ) -> Dict[str, object]:
+        """
+        压缩写入一条记录（阻塞 IO，调用方放到线程中执行）
+        :param dropped_lines: 因超出内存缓冲上限而未能保存的开头行数
+        """
+        self._ensure_loaded()
+        self.root.mkdir(parents=True, exist_ok=True)
+        record_id = f"{time.strftime('%Y%m%d%H%M%S', time.localtime(finished_at))}-{_UNSAFE.sub('_', key)}-{uuid.uuid4().hex[:6]}"
+
+        blocks: List[Tuple[int, int]] = []
+        total_lines = 0
+        total_bytes = 0
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".log.gz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                block: List[str] = []
+
+                def flush() -> None:
+                    if block:
+                        blocks.append((f.tell(), total_lines - len(block)))
+                        f.write(gzip.compress("".join(block).encode("utf-8", errors="replace")))
+                        block.clear()
+
+                for line in lines:
+                    text = line + "\n"
+                    block.append(text)
+                    total_lines += 1
+                    total_bytes += len(text.encode("utf-8", errors="replace"))
+                    if len(block) >= BLOCK_LINES:
+                        flush()
+                flush()
+                compressed_bytes = f.tell()
+            os.replace(tmp_name, self.root / f"{record_id}.log.gz")
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+
+        meta: Dict[str, object] = {
+            "id": record_id,
+            "key": key,
+            "startedAt": started_at,
+            "finishedAt": finished_at,
+            "durationSeconds": round(finished_at - started_at, 3),
+            "returnCode": return_code,
+            "lines": total_lines,
+            "droppedLines": dropped_lines,
+            "bytes": total_bytes,
+            "compressedBytes": compressed_bytes,
+            "blocks": blocks,
+        }
+        meta_path = self.root / f"{record_id}.json"
+        tmp_meta = meta_path.with_name(f".tmp-{meta_path.name}")
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_meta, meta_path)
+
+        summary = _summary(meta)
+        self._records.append(summary)
+        self._evict()
+        return summary
+
+    def list(self, offset: int = 0, limit: int = 20, key: Optional[str] = None) -> Tuple[int, List[Dict[str, object]]]:
+        """按结束时间倒序分页，返回 (总数, 当前页)"""
+        self._ensure_loaded()
+        records = [r for r in self._records if key is None or r.get("key") == key]
+        records.reverse()
+        return len(records), records[offset : offset + limit]
+
+    def latest(self, key: str) -> Optional[Dict[str, object]]:
+        self._ensure_loaded()
+        for record in reversed(self._records):
+            if record.get("key") == key:
+                return record
+        return None
+
+    def read_log(
+        self, record_id: str, offset: Optional[int] = None, limit: int = 200, tail: Optional[int] = None
+    ) -> Optional[Dict[str, object]]:
+        """
+        读取日志的一段：tail 指定时取最后 tail 行，否则从第 offset 行起取 limit 行
+        只定位并解压覆盖该区间的块
+        """
+        if _UNSAFE.search(record_id):
+            return None
+        try:
+            meta = json.loads((self.root / f"{record_id}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        total = int(meta.get("lines") or 0)
+        if tail is not None:
+            start = max(0, total - tail)
+            end = total
+        else:
+            start = max(0, offset or 0)
+            end = min(total, start + limit)
+        lines: List[str] = []
+        if start < end:
+            lines = _read_range(self.root / f"{record_id}.log.gz", meta.get("blocks") or [], start, end)
+        return {"id": record_id, "firstLine": start, "totalLines": total, "lines": lines}
+
+    def _evict(self) -> None:
+        while len(self._records) > self.max_records:
+            record = self._records.pop(0)
+            for suffix in (".json", ".log.gz"):
+                try:
+                    (self.root / f"{record['id']}{suffix}").unlink()
+                except OSError:
+                    pass
+
+
+def _summary(meta: Dict[str, object]) -> Dict[str, object]:
+    return {name: value for name, value in meta.items() if name != "blocks"}
+
+
+def _read_range(path: Path, blocks: List[List[int]], start: int, end: int) -> List[str]:
+    # 找到包含 start 的块，从其偏移处开始逐块解压，直到覆盖 end
+    first = 0
+    for index, (_, first_line) in enumerate(blocks):
+        if first_line <= start:
+            first = index
+    lines: List[str] = []
+    try:
+        with open(path, "rb") as f:
+            for index in range(first, len(blocks)):
+                block_offset, first_line = blocks[index]
+                if first_line >= end:
+                    break
+                next_offset = blocks[index + 1][0] if index + 1 < len(blocks) else None
+                f.seek(block_offset)
+                data = f.read() if next_offset is None else f.read(next_offset - block_offset)
+                block_lines = gzip.decompress(data).decode("utf-8", errors="replace").split("\n")[:-1]
+                for number, line in enumerate(block_lines, start=first_line):
+                    if start <= number < end:
+                        lines.append(line)
+    except (OSError, EOFError, gzip.BadGzipFile) as e:
+        logger.warning("failed to read install history %s: %s", path, e)
+    return lines
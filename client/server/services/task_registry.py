@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from .installer_service import InstallerTask
+
+
+class TaskRegistry:
+    """
+    key -> InstallerTask
+    运行中、排队中的任务始终保留；已结束的任务超过 max_age 秒或超出 max_finished 个时按结束先后淘汰，
+    淘汰后的状态与日志从持久化的安装历史中读取
+    """
+
+    def __init__(self, max_finished: int = 50, max_age: float = 3600.0):
+        self.max_finished = max(0, max_finished)
+        self.max_age = max_age
+        self._tasks: Dict[str, "InstallerTask"] = {}
+
+    def get(self, key: str) -> Optional["InstallerTask"]:
+        return self._tasks.get(key)
+
+    def __getitem__(self, key: str) -> "InstallerTask":
+        return self._tasks[key]
+
+    def __setitem__(self, key: str, task: "InstallerTask") -> None:
+        self._tasks[key] = task
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._tasks
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._tasks)
+
+    def values(self) -> List["InstallerTask"]:
+        return list(self._tasks.values())
+
+    def prune(self, now: Optional[float] = None) -> List[str]:
+        """淘汰过期或超量的已结束任务，返回被淘汰的 key"""
+        now = time.time() if now is None else now
+        finished = sorted(
+            (task for task in self._tasks.values() if task.finished_at is not None),
+            key=lambda task: task.finished_at or 0.0,
+        )
+        evicted: List[str] = []
+        for index, task in enumerate(finished):
+            too_many = len(finished) - index > self.max_finished
+            too_old = self.max_age > 0 and now - (task.finished_at or now) > self.max_age
+            if too_many or too_old:
+                # 同一 key 可能已被新的任务替换，只删除这个已结束的实例
+                if self._tasks.get(task.key) is task:
+                    del self._tasks[task.key]
+                    evicted.append(task.key)
+        return evicted
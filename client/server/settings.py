@@ -15,6 +15,23 @@ class Settings:
     scripts_dir: Path
     software_list: list
     resource_server_base: str
+    http_max_connections: int
+    http_max_keepalive: int
+    check_concurrency: int
+    check_ttl: float
+    log_max_lines: int
+    log_max_bytes: int
+    log_flush_interval: float
+    apt_status_fd: bool
+    install_concurrency: int
+    prefetch_concurrency: int
+    artifact_cache_max_bytes: int
+    apt_index_ttl: float
+    state_dir: Path
+    history_dir: Path
+    history_max_records: int
+    task_max_finished: int
+    task_max_age: float
 
     @staticmethod
     def load() -> "Settings":
@@ -31,6 +48,25 @@ class Settings:
         port = int(os.environ.get("INSTALLER_PORT", "8080"))
 
         resource_server_base = os.environ.get("RESOURCE_SERVER_BASE", "").rstrip("/")
+        http_max_connections = int(os.environ.get("INSTALLER_HTTP_MAX_CONNECTIONS", "20"))
+        http_max_keepalive = int(os.environ.get("INSTALLER_HTTP_MAX_KEEPALIVE", "10"))
+        check_concurrency = int(os.environ.get("INSTALLER_CHECK_CONCURRENCY", "8"))
+        check_ttl = float(os.environ.get("INSTALLER_CHECK_TTL", "30"))
+        log_max_lines = int(os.environ.get("INSTALLER_LOG_MAX_LINES", "5000"))
+        log_max_bytes = int(os.environ.get("INSTALLER_LOG_MAX_BYTES", str(1024 * 1024)))
+        log_flush_interval = float(os.environ.get("INSTALLER_LOG_FLUSH_INTERVAL", "0.1"))
+        install_concurrency = int(os.environ.get("INSTALLER_CONCURRENCY", "3"))
+        prefetch_concurrency = int(os.environ.get("INSTALLER_PREFETCH_CONCURRENCY", "4"))
+        artifact_cache_max_bytes = int(os.environ.get("INSTALLER_ARTIFACT_CACHE_MB", "4096")) * 1024 * 1024
+        apt_index_ttl = float(os.environ.get("INSTALLER_APT_INDEX_TTL", "600"))
+        # 需要跨重启保留的数据（目录副本、安装历史）默认放在持久化的 /config 下，本地开发时退回到项目目录
+        default_state_dir = "/config/appstore" if os.path.isdir("/config") else str(project_root / ".state")
+        state_dir = Path(os.environ.get("INSTALLER_STATE_DIR", default_state_dir))
+        history_dir = Path(os.environ.get("INSTALLER_HISTORY_DIR", str(state_dir / "history")))
+        history_max_records = int(os.environ.get("INSTALLER_HISTORY_MAX_RECORDS", "500"))
+        task_max_finished = int(os.environ.get("INSTALLER_TASK_MAX_FINISHED", "50"))
+        task_max_age = float(os.environ.get("INSTALLER_TASK_MAX_AGE", "3600"))
+        apt_status_fd = os.environ.get("INSTALLER_APT_STATUS_FD", "1").lower() not in ("0", "false", "no")
 
         return Settings(
             host=host,
@@ -40,6 +76,23 @@ class Settings:
             scripts_dir=scripts_dir,
             software_list=[],  # 不再使用本地软件列表，所有软件信息从服务端获取
             resource_server_base=resource_server_base,
+            http_max_connections=http_max_connections,
+            http_max_keepalive=http_max_keepalive,
+            check_concurrency=check_concurrency,
+            check_ttl=check_ttl,
+            log_max_lines=log_max_lines,
+            log_max_bytes=log_max_bytes,
+            log_flush_interval=log_flush_interval,
+            apt_status_fd=apt_status_fd,
+            install_concurrency=install_concurrency,
+            prefetch_concurrency=prefetch_concurrency,
+            artifact_cache_max_bytes=artifact_cache_max_bytes,
+            apt_index_ttl=apt_index_ttl,
+            state_dir=state_dir,
+            history_dir=history_dir,
+            history_max_records=history_max_records,
+            task_max_finished=task_max_finished,
+            task_max_age=task_max_age,
         )
 
 
@@ -1,17 +1,82 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from typing import Dict, List, Optional
+
+from .routes import api_router, assets_router
+from .services.artifact_cache import ArtifactCache
+from .services.catalog import CatalogIndex
+from .services.catalog_events import CatalogEvents
+from .services.catalog_watcher import CatalogWatcher
+from .services.icon_pipeline import IconPipeline
+from .services.response_cache import CatalogResponseCache
+
+
+def create_app(
+    data_root: Path,
+    watch_mode: str = "auto",
+    poll_interval: float = 2.0,
+    proxy_upstreams: Optional[Dict[str, str]] = None,
+    proxy_cache_dir: Optional[Path] = None,
+    proxy_cache_max_bytes: int = 10 * 1024 ** 3,
+    icon_cache_dir: Optional[Path] = None,
+) -> FastAPI:
+    # 启动时建立软件目录索引，请求只做内存查找
+    catalog = CatalogIndex(data_root)
+    catalog.build()
+    # 图标缩略图与 WebP 版本按源文件哈希缓存，与制品缓存一样不放在 data_root 下
+    icon_pipeline = IconPipeline(icon_cache_dir or Path(__file__).resolve().parents[1] / "cache" / "icons")
+
+    def warm_icons() -> None:
+        # 建立索引或目录变化后在后台生成缺失的缩略图，请求到达时通常已经就绪
+        entries = [entry for os_id in catalog.os_ids() for entry in catalog.entries(os_id)]
+        asyncio.get_running_loop().run_in_executor(None, icon_pipeline.prepare, entries)
 
-from .routes import api_router
+    # 目录变化时推送给订阅了 /api/v1/software/events 的客户端
+    catalog_events = CatalogEvents(catalog)
 
+    def on_catalog_change(os_ids: List[str]) -> None:
+        catalog_events.publish(os_ids)
+        warm_icons()
 
-def create_app(data_root: Path) -> FastAPI:
-    app = FastAPI(title="Software Store Server", version="1.0.0")
+    watcher = CatalogWatcher(catalog, mode=watch_mode, poll_interval=poll_interval, on_change=on_catalog_change)
+
+    # 制品缓存代理：/api/v1/proxy/<upstream>/<path> 转发到配置的上游并缓存到本地磁盘
+    # 缓存目录不能放在 data_root 下，否则会被 /static 暴露
+    upstreams = {name: url.rstrip("/") for name, url in (proxy_upstreams or {}).items()}
+    default_cache_dir = Path(__file__).resolve().parents[1] / "cache" / "artifacts"
+    artifact_cache = ArtifactCache(proxy_cache_dir or default_cache_dir, max_bytes=proxy_cache_max_bytes)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # 运行期间监听 data 目录，增量刷新索引
+        watcher.start()
+        warm_icons()
+        if upstreams:
+            await artifact_cache.startup()
+        try:
+            yield
+        finally:
+            await watcher.stop()
+            await artifact_cache.shutdown()
+
+    app = FastAPI(title="Software Store Server", version="1.0.0", lifespan=lifespan)
     app.include_router(api_router, prefix="/api/v1")
+    # 带内容哈希的脚本/图标：/assets/<hash>/software/<os>/<scripts|icons>/<file>，永久缓存
+    app.include_router(assets_router, prefix="/assets", tags=["assets"])
+    app.state.catalog = catalog
+    app.state.catalog_watcher = watcher
+    app.state.catalog_events = catalog_events
+    app.state.response_cache = CatalogResponseCache()
+    app.state.icon_pipeline = icon_pipeline
+    app.state.icon_bundle_cache = CatalogResponseCache(max_entries=16)
+    app.state.proxy_upstreams = upstreams
+    app.state.artifact_cache = artifact_cache
 
     # 挂载静态资源，暴露 data 目录（只读）
     app.state.data_root = str(data_root)
     app.mount("/static", StaticFiles(directory=data_root, html=False), name="static")
     return app
-
-
@@ -2,17 +2,37 @@ from __future__ import annotations
 
 import os
 from pathlib import Path
+from typing import Dict
 
 import uvicorn
 
 from . import create_app
 
 
+def _parse_upstreams(value: str) -> Dict[str, str]:
+    # 形如 "nexus=http://192.168.2.239:8081,ubuntu=http://archive.ubuntu.com"
+    upstreams: Dict[str, str] = {}
+    for part in value.split(","):
+        name, sep, url = part.strip().partition("=")
+        if sep and name.strip() and url.strip():
+            upstreams[name.strip()] = url.strip()
+    return upstreams
+
+
 def run() -> None:
     # 默认指向 server/data，支持通过 DATA_ROOT 覆盖
     default_data = Path(__file__).resolve().parents[1] / "data"
     data_root = Path(os.environ.get("DATA_ROOT", str(default_data)))
-    app = create_app(data_root=data_root)
+    # CATALOG_WATCH: auto（默认，优先 inotify）/ inotify / poll / off
+    app = create_app(
+        data_root=data_root,
+        watch_mode=os.environ.get("CATALOG_WATCH", "auto"),
+        poll_interval=float(os.environ.get("CATALOG_POLL_INTERVAL", "2")),
+        proxy_upstreams=_parse_upstreams(os.environ.get("PROXY_UPSTREAMS", "")),
+        proxy_cache_dir=Path(os.environ["PROXY_CACHE_DIR"]) if os.environ.get("PROXY_CACHE_DIR") else None,
+        proxy_cache_max_bytes=int(os.environ.get("PROXY_CACHE_MAX_MB", "10240")) * 1024 * 1024,
+        icon_cache_dir=Path(os.environ["ICON_CACHE_DIR"]) if os.environ.get("ICON_CACHE_DIR") else None,
+    )
 
     host = os.environ.get("SERVER_HOST", "0.0.0.0")
     port = int(os.environ.get("SERVER_PORT", "8081"))
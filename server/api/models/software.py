@@ -0,0 +1,14 @@
+from __future__ import annotations
+
+from typing import List
+
+from pydantic import BaseModel, Field
+
+
+class SoftwareBatchRequest(BaseModel):
+    """批量获取软件详情"""
+
+    keys: List[str] = Field(..., min_length=1, max_length=200)
+    os_id: str = "ubuntu"
+    # 为 true 时在响应中内联脚本内容及其 sha256
+    include_scripts: bool = False
@@ -1,7 +1,10 @@
 from fastapi import APIRouter
 
+from .assets import router as assets_router
+from .proxy import router as proxy_router
 from .software import router as software_router
 
 api_router = APIRouter()
 api_router.include_router(software_router, prefix="/software", tags=["software"])
+api_router.include_router(proxy_router, prefix="/proxy", tags=["proxy"])
 
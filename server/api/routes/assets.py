@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse
+
+from ..services.catalog import CatalogIndex
+from ..services.conditional import is_not_modified
+
+
+router = APIRouter()
+
+# URL 中带内容哈希，内容变化时 URL 随之变化，可以让浏览器与客户端永久缓存
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_KINDS = ("scripts", "icons")
+
+
+@router.get("/{digest}/software/{os_id}/{kind}/{name}", response_model=None)
+def get_asset(request: Request, digest: str, os_id: str, kind: str, name: str) -> Response:
+    catalog: CatalogIndex = request.app.state.catalog
+    entry = catalog.get(os_id, Path(name).stem) if kind in ASSET_KINDS else None
+    asset = entry.asset(kind, name) if entry is not None else None
+    if asset is None:
+        raise HTTPException(status_code=404, detail="not found")
+    path, current = asset
+
+    if digest != current:
+        # 文件在 URL 发出后已变化：重定向到当前版本，旧 URL 不能被当作 immutable 缓存
+        return RedirectResponse(
+            f"/assets/{current}/software/{os_id}/{kind}/{name}",
+            status_code=307,
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    etag = f'"{current}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        raise HTTPException(status_code=404, detail="not found")
+    if is_not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+    # FileResponse 自带 Range / If-Range 支持，大文件可以断点续传
+    return FileResponse(path, headers=headers)
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from ..services.artifact_cache import PASSTHROUGH_HEADERS, ArtifactCache
+
+
+router = APIRouter()
+
+
+def _is_cacheable(path: str) -> bool:
+    # apt 的 dists/ 下是会变化的索引（Release、Packages 等），只转发不缓存；
+    # pool/ 下的 .deb 与其他制品文件名带版本，内容不变，可以长期缓存
+    return "/dists/" not in f"/{path}"
+
+
+@router.get("/{upstream}/{path:path}")
+async def proxy_artifact(request: Request, upstream: str, path: str) -> Response:
+    base = request.app.state.proxy_upstreams.get(upstream)
+    if not base:
+        raise HTTPException(status_code=404, detail="unknown upstream")
+    url = f"{base}/{path}"
+    if request.url.query:
+        url = f"{url}?{request.url.query}"
+    cache: ArtifactCache = request.app.state.artifact_cache
+
+    if not _is_cacheable(path):
+        try:
+            upstream_resp = await cache.passthrough(url)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"upstream error: {e}")
+        headers = {k: upstream_resp.headers[k] for k in PASSTHROUGH_HEADERS + ("content-length",) if k in upstream_resp.headers}
+        return StreamingResponse(
+            upstream_resp.aiter_raw(),
+            status_code=upstream_resp.status_code,
+            headers=headers,
+            background=BackgroundTask(upstream_resp.aclose),
+        )
+
+    cached = cache.cached_path(url)
+    if cached is not None:
+        # 完整缓存由 FileResponse 返回，自带 Range / 条件请求支持
+        headers = {k: v for k, v in cache.cached_headers(url).items() if k in PASSTHROUGH_HEADERS}
+        return FileResponse(cached, headers=headers, media_type=headers.get("content-type"))
+
+    download = await cache.join(url)
+    if download.status_code != 200 or (download.error is not None and download.written == 0):
+        status = download.status_code if 400 <= download.status_code < 500 else 502
+        raise HTTPException(status_code=status, detail=download.error or "upstream error")
+    try:
+        f = cache.open_download(download)
+    except OSError:
+        raise HTTPException(status_code=502, detail=download.error or "upstream error")
+    return StreamingResponse(cache.follow(download, f), headers=dict(download.headers))
@@ -1,11 +1,20 @@
 from __future__ import annotations
 
+import hashlib
 import json
-from pathlib import Path
-from typing import Dict, List, Optional
+from email.utils import formatdate
+from typing import AsyncGenerator, Dict, List, Optional
 
 from fastapi import APIRouter, HTTPException, Query
-from fastapi import Request
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from ..models.software import SoftwareBatchRequest
+from ..services.catalog import CatalogIndex, SoftwareEntry, asset_digest
+from ..services.catalog_events import CatalogEvents
+from ..services.conditional import is_not_modified
+from ..services.icon_pipeline import DEFAULT_ICON_SIZE, IconPipeline, data_url
+from ..services.response_cache import CatalogResponseCache, choose_encoding
 
 
 router = APIRouter()
@@ -20,88 +29,210 @@ def _build_base_url(request: Request) -> str:
     return f"{scheme}://{host}"
 
 
-def _load_software_metadata(os_dir: Path, key: str) -> Dict[str, object]:
-    """加载软件元数据文件（JSON），如果存在的话"""
-    metadata_file = os_dir / "metadata" / f"{key}.json"
-    if metadata_file.exists():
-        try:
-            with open(metadata_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            pass
-    return {}
+def _get_catalog(request: Request) -> CatalogIndex:
+    return request.app.state.catalog
 
 
-def _list_software_items(data_root: Path, os_id: str) -> List[Dict[str, object]]:
-    os_dir = data_root / "software" / os_id
-    if not os_dir.exists():
-        return []
+def _catalog_etag(catalog: CatalogIndex, os_id: str, base: str) -> str:
+    # 响应体中的 URL 依赖 base，并带有代数与版本（服务端重启后会变化），ETag 需全部覆盖
+    key = f"{catalog.digest(os_id)}|{base}|{catalog.generation(os_id)}|{catalog.version(os_id)}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
 
-    # 支持以每个软件一个目录或一个json的形式；此处实现简单目录扫描：
-    # - 脚本目录: data/software/<os>/scripts/<key>.sh
-    # - 图标目录: data/software/<os>/icons/<key>.(png|svg)
-    # - 元数据目录: data/software/<os>/metadata/<key>.json (可选)
-    scripts_dir = os_dir / "scripts"
-    icons_dir = os_dir / "icons"
 
-    items: List[Dict[str, object]] = []
-    if scripts_dir.exists():
-        for script_path in scripts_dir.glob("*.sh"):
-            key = script_path.stem
-            icon_file: Optional[Path] = None
-            for ext in ("png", "svg"):
-                candidate = icons_dir / f"{key}.{ext}"
-                if candidate.exists():
-                    icon_file = candidate
-                    break
-
-            # 加载元数据（如果存在）
-            metadata = _load_software_metadata(os_dir, key)
-            
-            item = {
-                "key": key,
-                "name": metadata.get("name", key),  # 优先使用元数据中的名称
-                "requires_root": metadata.get("requires_root", True),
-                "checkCommand": metadata.get("checkCommand"),  # 安装检测命令
-                # icon/script URL 在handler中补全
-                "_script_rel": f"/static/software/{os_id}/scripts/{script_path.name}",
-                "_icon_rel": f"/static/software/{os_id}/icons/{icon_file.name}" if icon_file else "",
-            }
-            items.append(item)
-
-    return items
-
-
-@router.get("")
-def list_software(request: Request, os_id: str = Query("ubuntu")) -> Dict[str, object]:
-    data_root = Path(request.app.state.data_root)
-    base = _build_base_url(request)
-    items = _list_software_items(data_root, os_id)
+def _get_response_cache(request: Request) -> CatalogResponseCache:
+    return request.app.state.response_cache
 
-    # 将相对URL转为绝对URL，方便客户端直接引用
-    result: List[Dict[str, object]] = []
-    for it in items:
-        icon_rel = it.pop("_icon_rel", "")
-        script_rel = it.pop("_script_rel", "")
-        it["iconUrl"] = f"{base}{icon_rel}" if icon_rel else ""
-        it["scriptUrl"] = f"{base}{script_rel}" if script_rel else ""
-        result.append(it)
 
-    return {"items": result}
+def _list_software_items(catalog: CatalogIndex, os_id: str) -> List[Dict[str, object]]:
+    # 直接从内存索引序列化，不再逐次扫描目录
+    return [entry.to_item() for entry in catalog.entries(os_id)]
 
 
-@router.get("/{key}")
-def get_software(request: Request, key: str, os_id: str = Query("ubuntu")) -> Dict[str, object]:
-    data_root = Path(request.app.state.data_root)
+def _absolutize(item: Dict[str, object], base: str) -> Dict[str, object]:
+    # 将相对URL转为绝对URL，方便客户端直接引用
+    icon_rel = item.pop("_icon_rel", "")
+    script_rel = item.pop("_script_rel", "")
+    item["iconUrl"] = f"{base}{icon_rel}" if icon_rel else ""
+    item["scriptUrl"] = f"{base}{script_rel}" if script_rel else ""
+    return item
+
+
+@router.get("", response_model=None)
+def list_software(request: Request, os_id: str = Query("ubuntu")) -> Response:
+    catalog = _get_catalog(request)
+    base = _build_base_url(request)
+    generation = catalog.generation(os_id)
+    etag = _catalog_etag(catalog, os_id, base)
+    last_modified = catalog.last_modified(os_id)
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Catalog-Generation": str(generation),
+        "X-Catalog-Version": str(catalog.version(os_id)),
+        "Vary": "Accept-Encoding",
+    }
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+    # 只由 ETag 判断：If-Modified-Since 只有秒级精度，同一秒内的两次变化会被误判为未修改
+    if is_not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+
+    def render(url_base: str) -> Dict[str, object]:
+        items = _list_software_items(catalog, os_id)
+        return {
+            "generation": generation,
+            "version": catalog.version(os_id),
+            "items": [_absolutize(it, url_base) for it in items],
+        }
+
+    # 序列化与压缩结果按 (os_id, base) 缓存，目录代数变化时自动失效；未知的 os_id 不进缓存
+    encoded = _get_response_cache(request).get(
+        os_id, base, generation, render, store=os_id in catalog.os_ids()
+    )
+    encoding = choose_encoding(request.headers.get("accept-encoding"), list(encoded.variants))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+        # 压缩后的表示与原始字节不同，按 RFC 使用弱 ETag
+        headers["ETag"] = f"W/{etag}"
+    return Response(content=encoded.variants[encoding], media_type="application/json", headers=headers)
+
+
+@router.get("/generation")
+def get_generation(request: Request, os_id: str = Query("ubuntu")) -> Dict[str, object]:
+    # 轻量查询：客户端可先比较代数，再决定是否拉取完整列表
+    return {"os_id": os_id, "generation": _get_catalog(request).generation(os_id)}
+
+
+@router.get("/events")
+async def stream_catalog_events(
+    request: Request, os_id: str = Query("ubuntu"), since: Optional[int] = Query(None)
+) -> StreamingResponse:
+    # 目录变化推送（SSE）：连接时先发送一次当前状态（since / Last-Event-ID 与当前版本相同时跳过），
+    # 之后每次变化发送一个 catalog 事件，事件 ID 为目录版本；空闲时发送心跳
+    events: CatalogEvents = request.app.state.catalog_events
+    last_event_id = request.headers.get("last-event-id", "")
+    if since is None and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def generator() -> AsyncGenerator[bytes, None]:
+        async for state in events.stream(os_id, since):
+            if state is None:
+                yield b": ping\n\n"
+                continue
+            yield f"id: {state['version']}\nevent: catalog\ndata: {json.dumps(state)}\n\n".encode()
+
+    resp = StreamingResponse(generator(), media_type="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+@router.get("/changes")
+def get_changes(
+    request: Request, os_id: str = Query("ubuntu"), since: Optional[int] = Query(None)
+) -> Dict[str, object]:
+    # 增量同步：只返回 since 之后新增、变化的条目与删除的 key；
+    # since 缺失或早于服务端保留的基线（如服务端重启）时 reset=true 并全量下发
+    catalog = _get_catalog(request)
+    base = _build_base_url(request)
+    version = catalog.version(os_id)
+    delta = catalog.changes(os_id, since)
+    if delta is None:
+        added = [_absolutize(it, base) for it in _list_software_items(catalog, os_id)]
+        return {"os_id": os_id, "version": version, "reset": True, "added": added, "changed": [], "removed": []}
+    return {
+        "os_id": os_id,
+        "version": version,
+        "reset": False,
+        "added": [_absolutize(entry.to_item(), base) for entry in delta["added"]],
+        "changed": [_absolutize(entry.to_item(), base) for entry in delta["changed"]],
+        "removed": delta["removed"],
+    }
+
+
+@router.get("/icons", response_model=None)
+def get_icon_bundle(
+    request: Request,
+    os_id: str = Query("ubuntu"),
+    size: int = Query(DEFAULT_ICON_SIZE),
+    fmt: Optional[str] = Query(None, alias="format"),
+) -> Response:
+    # 一次返回 os_id 下全部图标的缩略图（data URL），页面加载只需这一个请求；
+    # 未指定 format 时按 Accept 选择 WebP，Pillow 不可用时退回原图
+    pipeline: IconPipeline = request.app.state.icon_pipeline
+    if size not in pipeline.sizes:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(pipeline.sizes)}")
+    if fmt is None:
+        fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "png"
+    if fmt not in ("png", "webp"):
+        raise HTTPException(status_code=400, detail="format must be png or webp")
+    if fmt not in pipeline.formats:
+        fmt = "png"
+
+    catalog = _get_catalog(request)
+    entries = [entry for entry in catalog.entries(os_id) if entry.icon_path is not None]
+    fingerprint = ",".join(f"{entry.key}:{entry.icon_hash}" for entry in entries)
+    digest = hashlib.sha256(f"{size}|{fmt}|{pipeline.formats}|{fingerprint}".encode("utf-8")).hexdigest()
+    etag = f'"{digest[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if is_not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+
+    def render(_: str) -> Dict[str, object]:
+        icons: Dict[str, object] = {}
+        for entry in entries:
+            variant = pipeline.variant(entry, size, fmt)
+            if variant is not None:
+                content, media_type = variant
+                icons[entry.key] = {
+                    "hash": asset_digest(entry.icon_hash),
+                    "type": media_type,
+                    "dataUrl": data_url(content, media_type),
+                }
+        return {"os_id": os_id, "size": size, "format": fmt, "icons": icons}
+
+    # 与列表响应一样缓存序列化与压缩结果，目录代数变化时失效
+    encoded = request.app.state.icon_bundle_cache.get(
+        f"{os_id}:{size}:{fmt}", "", catalog.generation(os_id), render, store=os_id in catalog.os_ids()
+    )
+    encoding = choose_encoding(request.headers.get("accept-encoding"), list(encoded.variants))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = f"W/{etag}"
+    return Response(content=encoded.variants[encoding], media_type="application/json", headers=headers)
+
+
+@router.post("/batch")
+def get_software_batch(request: Request, body: SoftwareBatchRequest) -> Dict[str, object]:
+    # 一次请求返回多个软件的详情，可选内联脚本，减少客户端批量安装时的往返
+    catalog = _get_catalog(request)
     base = _build_base_url(request)
-    items = _list_software_items(data_root, os_id)
-    for it in items:
-        if it.get("key") == key:
-            icon_rel = it.pop("_icon_rel", "")
-            script_rel = it.pop("_script_rel", "")
-            it["iconUrl"] = f"{base}{icon_rel}" if icon_rel else ""
-            it["scriptUrl"] = f"{base}{script_rel}" if script_rel else ""
-            return it
-    raise HTTPException(status_code=404, detail="not found")
+    items: List[Dict[str, object]] = []
+    missing: List[str] = []
+    for key in dict.fromkeys(body.keys):
+        entry = catalog.get(body.os_id, key)
+        if entry is None:
+            missing.append(key)
+            continue
+        item = _absolutize(entry.to_item(), base)
+        if body.include_scripts:
+            try:
+                content = entry.script_path.read_bytes()
+                # 非 UTF-8 脚本不内联，客户端回退到 scriptUrl 下载
+                item["script"] = content.decode("utf-8")
+                item["scriptHash"] = f"sha256:{hashlib.sha256(content).hexdigest()}"
+            except (OSError, UnicodeDecodeError):
+                pass
+        items.append(item)
+    return {"items": items, "missing": missing}
 
 
+@router.get("/{key}")
+def get_software(request: Request, key: str, os_id: str = Query("ubuntu")) -> Dict[str, object]:
+    entry: SoftwareEntry | None = _get_catalog(request).get(os_id, key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return _absolutize(entry.to_item(), _build_base_url(request))
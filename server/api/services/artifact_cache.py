@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, Optional
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+# 透传给客户端的上游响应头
+PASSTHROUGH_HEADERS = ("content-type", "content-encoding", "last-modified", "etag")
+# 向上游请求原始内容：缓存与转发的是未解码的字节，apt/wget 等客户端并未声明接受压缩编码
+UPSTREAM_HEADERS = {"Accept-Encoding": "identity"}
+
+
+@dataclass
+class Download:
+    """一次进行中的上游下载，所有并发请求者共享，边下边从临时文件读取"""
+
+    key: str
+    url: str
+    tmp_path: Path
+    headers_ready: asyncio.Event = field(default_factory=asyncio.Event)
+    changed: asyncio.Condition = field(default_factory=asyncio.Condition)
+    status_code: int = 0
+    headers: Dict[str, str] = field(default_factory=dict)
+    written: int = 0
+    done: bool = False
+    error: Optional[str] = None
+    # 已加入但尚未打开临时文件的请求者数
+    waiters: int = 0
+    # 超过缓存上限：不入缓存，临时文件在所有请求者打开后删除
+    uncached: bool = False
+
+
+class ArtifactCache:
+    """
+    制品/apt 归档的缓存代理
+    - 首个请求触发一次上游下载，文件边写入磁盘边流式返回
+    - 同一 URL 的并发请求合并为一次下载，后到者跟随读取同一个临时文件
+    - 完整下载的文件按 LRU 淘汰，总大小不超过 max_bytes；单个文件超过 max_bytes 时只转发不缓存
+    """
+
+    def __init__(self, root: Path, max_bytes: int, chunk_size: int = 256 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._inflight: Dict[str, Download] = {}
+        self._http: Optional[httpx.AsyncClient] = None
+
+    async def startup(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self._load_entries)
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0), follow_redirects=True, headers=UPSTREAM_HEADERS
+        )
+
+    async def shutdown(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _load_entries(self) -> None:
+        # 按最后使用时间（命中时会 touch mtime）恢复 LRU 顺序，并清理残留的临时文件
+        files = []
+        for path in self.root.iterdir():
+            if path.name.startswith(".tmp-"):
+                path.unlink(missing_ok=True)
+            elif path.suffix == "" and path.is_file():
+                st = path.stat()
+                files.append((st.st_mtime, path.name, st.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total += size
+        self._evict()
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def cached_path(self, url: str) -> Optional[Path]:
+        """命中完整缓存时返回文件路径并更新 LRU 顺序"""
+        key = self.key_for(url)
+        if key not in self._entries:
+            return None
+        path = self.root / key
+        if not path.is_file():
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def cached_headers(self, url: str) -> Dict[str, str]:
+        try:
+            return json.loads((self.root / f"{self.key_for(url)}.meta").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    async def join(self, url: str) -> Download:
+        """加入（必要时发起）对 url 的下载，等待上游响应头到达后返回"""
+        key = self.key_for(url)
+        download = self._inflight.get(key)
+        if download is None:
+            download = Download(key=key, url=url, tmp_path=self.root / f".tmp-{key}")
+            self._inflight[key] = download
+            # 下载与发起请求的客户端解耦：客户端断开不影响缓存填充
+            asyncio.create_task(self._fetch(download))
+        download.waiters += 1
+        try:
+            await download.headers_ready.wait()
+        except BaseException:
+            download.waiters -= 1
+            self._discard_if_unused(download)
+            raise
+        return download
+
+    def open_download(self, download: Download) -> BinaryIO:
+        # 下载完成后临时文件会被 rename 为正式文件，两个路径依次尝试
+        try:
+            try:
+                return open(download.tmp_path, "rb")
+            except FileNotFoundError:
+                return open(self.root / download.key, "rb")
+        finally:
+            download.waiters -= 1
+            self._discard_if_unused(download)
+
+    def _discard_if_unused(self, download: Download) -> None:
+        # 不入缓存的临时文件：下载结束且所有请求者都已打开（打开的句柄在删除后仍可读）
+        if download.done and download.uncached and download.waiters <= 0:
+            download.tmp_path.unlink(missing_ok=True)
+
+    async def passthrough(self, url: str) -> httpx.Response:
+        """不缓存的请求（如 apt 索引）直接流式转发，调用方负责关闭响应"""
+        assert self._http is not None
+        request = self._http.build_request("GET", url)
+        return await self._http.send(request, stream=True)
+
+    async def follow(self, download: Download, f: BinaryIO) -> AsyncIterator[bytes]:
+        """从临时文件中读取已写入的部分，随下载进度持续输出，直到下载完成"""
+        pos = 0
+        try:
+            while True:
+                async with download.changed:
+                    await download.changed.wait_for(lambda: download.written > pos or download.done)
+                    written, done, error = download.written, download.done, download.error
+                while pos < written:
+                    # 制品可达数百 MB，磁盘读写放到线程中，不阻塞事件循环
+                    chunk = await asyncio.to_thread(f.read, min(self.chunk_size, written - pos))
+                    if not chunk:
+                        break
+                    pos += len(chunk)
+                    yield chunk
+                if done:
+                    if error is not None:
+                        # 上游中途失败：截断响应，客户端会感知到长度不符
+                        raise RuntimeError(error)
+                    return
+        finally:
+            f.close()
+
+    async def _fetch(self, download: Download) -> None:
+        assert self._http is not None
+        out: Optional[BinaryIO] = None
+        try:
+            async with self._http.stream("GET", download.url) as resp:
+                download.status_code = resp.status_code
+                download.headers = {
+                    name: resp.headers[name] for name in PASSTHROUGH_HEADERS if name in resp.headers
+                }
+                if resp.status_code != 200:
+                    download.error = f"upstream returned {resp.status_code}"
+                    return
+                if "content-length" in resp.headers:
+                    download.headers["content-length"] = resp.headers["content-length"]
+                out = await asyncio.to_thread(open, download.tmp_path, "wb")
+                download.headers_ready.set()
+                async for chunk in resp.aiter_raw(self.chunk_size):
+                    await asyncio.to_thread(_write_chunk, out, chunk)
+                    async with download.changed:
+                        download.written += len(chunk)
+                        download.changed.notify_all()
+            await asyncio.to_thread(out.close)
+            out = None
+            if download.written > self.max_bytes:
+                # 提交后会被立即淘汰，后到的合并请求将打不开文件；改为只从临时文件服务当前请求者
+                logger.info("artifact larger than cache limit, not cached: %s", download.url)
+                download.uncached = True
+            else:
+                await asyncio.to_thread(self._commit_files, download)
+                self._commit(download)
+        except Exception as e:
+            logger.warning("artifact fetch failed: %s: %s", download.url, e)
+            download.error = download.error or str(e)
+            if not download.status_code:
+                download.status_code = 502
+        finally:
+            if out is not None:
+                out.close()
+            if download.error is not None:
+                download.tmp_path.unlink(missing_ok=True)
+            self._inflight.pop(download.key, None)
+            download.headers_ready.set()
+            async with download.changed:
+                download.done = True
+                download.changed.notify_all()
+            self._discard_if_unused(download)
+
+    def _commit_files(self, download: Download) -> None:
+        (self.root / f"{download.key}.meta").write_text(
+            json.dumps(dict(download.headers, url=download.url)), encoding="utf-8"
+        )
+        os.replace(download.tmp_path, self.root / download.key)
+
+    def _commit(self, download: Download) -> None:
+        self._forget(download.key)
+        self._entries[download.key] = download.written
+        self._total += download.written
+        self._evict()
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total -= size
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            (self.root / key).unlink(missing_ok=True)
+            (self.root / f"{key}.meta").unlink(missing_ok=True)
+
+
+def _write_chunk(out: BinaryIO, chunk: bytes) -> None:
+    out.write(chunk)
+    out.flush()
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# 图标按顺序查找，先找到的优先
+ICON_EXTS = ("png", "svg")
+
+
+@dataclass
+class SoftwareEntry:
+    """单个软件的索引项：预先解析好的脚本/图标路径与元数据"""
+
+    key: str
+    os_id: str
+    script_path: Path
+    icon_path: Optional[Path] = None
+    metadata: Dict[str, object] = field(default_factory=dict)
+    # 脚本内容的 sha256，客户端据此复用本地缓存的脚本
+    script_hash: str = ""
+    # 图标内容的 sha256，用于生成带内容哈希的图标 URL
+    icon_hash: str = ""
+    # 脚本/元数据/图标的 (mtime_ns, size)，用于判断条目是否真的变化
+    fingerprint: Tuple[Tuple[int, int], ...] = ()
+
+    def to_item(self) -> Dict[str, object]:
+        """序列化为接口条目，icon/script 仍为相对URL（带内容哈希，可永久缓存），由 handler 补全"""
+        metadata = self.metadata
+        return {
+            "key": self.key,
+            "name": metadata.get("name", self.key),  # 优先使用元数据中的名称
+            "requires_root": metadata.get("requires_root", True),
+            "checkCommand": metadata.get("checkCommand"),  # 安装检测命令
+            "scriptHash": self.script_hash,
+            # 脚本是否需要 dpkg 锁（apt/dpkg 安装），未声明时由客户端扫描脚本判断
+            "dpkgLock": metadata.get("dpkgLock"),
+            # 安装前可预取的安装包 [{"name", "url", "sha256"?}]
+            "artifacts": metadata.get("artifacts") or [],
+            # 依赖的软件 key、所属套装、可合并到一次 apt 事务的包
+            "dependsOn": metadata.get("dependsOn") or [],
+            "bundles": metadata.get("bundles") or [],
+            "aptPackages": metadata.get("aptPackages") or [],
+            "_script_rel": _asset_url(self.os_id, "scripts", self.script_path.name, self.script_hash),
+            "_icon_rel": _asset_url(self.os_id, "icons", self.icon_path.name, self.icon_hash) if self.icon_path else "",
+        }
+
+    def asset(self, kind: str, name: str) -> Optional[Tuple[Path, str]]:
+        """本条目的脚本/图标文件及其短内容哈希，不属于本条目时返回 None"""
+        if kind == "scripts" and name == self.script_path.name:
+            return self.script_path, asset_digest(self.script_hash)
+        if kind == "icons" and self.icon_path is not None and name == self.icon_path.name:
+            return self.icon_path, asset_digest(self.icon_hash)
+        return None
+
+
+def asset_digest(content_hash: str) -> str:
+    """URL 中使用的短内容哈希（sha256 前 16 位）"""
+    return content_hash.partition(":")[2][:16]
+
+
+def _asset_url(os_id: str, kind: str, name: str, content_hash: str) -> str:
+    # 内容变化即 URL 变化，/assets 下的响应可以标记为 immutable；哈希缺失时退回普通静态路径
+    digest = asset_digest(content_hash)
+    if not digest:
+        return f"/static/software/{os_id}/{kind}/{name}"
+    return f"/assets/{digest}/software/{os_id}/{kind}/{name}"
+
+
+def load_software_metadata(os_dir: Path, key: str) -> Dict[str, object]:
+    """加载软件元数据文件（JSON），如果存在的话"""
+    metadata_file = os_dir / "metadata" / f"{key}.json"
+    if metadata_file.exists():
+        try:
+            with open(metadata_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            pass
+    return {}
+
+
+def build_entry(os_dir: Path, key: str) -> Optional[SoftwareEntry]:
+    """为单个 key 建立索引项；脚本不存在时返回 None"""
+    script_path = os_dir / "scripts" / f"{key}.sh"
+    if not script_path.is_file():
+        return None
+
+    icon_path: Optional[Path] = None
+    for ext in ICON_EXTS:
+        candidate = os_dir / "icons" / f"{key}.{ext}"
+        if candidate.exists():
+            icon_path = candidate
+            break
+
+    return SoftwareEntry(
+        key=key,
+        os_id=os_dir.name,
+        script_path=script_path,
+        icon_path=icon_path,
+        metadata=load_software_metadata(os_dir, key),
+        script_hash=_hash_file(script_path),
+        icon_hash=_hash_file(icon_path) if icon_path else "",
+        fingerprint=(
+            _stat_pair(script_path),
+            _stat_pair(os_dir / "metadata" / f"{key}.json"),
+            _stat_pair(icon_path),
+        ),
+    )
+
+
+def _hash_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                hasher.update(chunk)
+    except OSError:
+        return ""
+    return f"sha256:{hasher.hexdigest()}"
+
+
+def _stat_pair(path: Optional[Path]) -> Tuple[int, int]:
+    if path is None:
+        return (0, 0)
+    try:
+        st = path.stat()
+    except OSError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def scan_os_dir(os_dir: Path) -> Dict[str, SoftwareEntry]:
+    # 目录约定：
+    # - 脚本目录: data/software/<os>/scripts/<key>.sh
+    # - 图标目录: data/software/<os>/icons/<key>.(png|svg)
+    # - 元数据目录: data/software/<os>/metadata/<key>.json (可选)
+    entries: Dict[str, SoftwareEntry] = {}
+    scripts_dir = os_dir / "scripts"
+    if not scripts_dir.exists():
+        return entries
+    for script_path in sorted(scripts_dir.glob("*.sh")):
+        entry = build_entry(os_dir, script_path.stem)
+        if entry is not None:
+            entries[entry.key] = entry
+    return entries
+
+
+class CatalogIndex:
+    """按 os_id 划分的内存软件目录索引，启动时扫描一次 data/software"""
+
+    def __init__(self, data_root: Path):
+        self.data_root = Path(data_root)
+        self.software_root = self.data_root / "software"
+        self._indexes: Dict[str, Dict[str, SoftwareEntry]] = {}
+        # 每个 os_id 的目录代数，接口输出变化时递增，客户端据此判断目录是否更新
+        self._generations: Dict[str, int] = {}
+        # 每个 os_id 的内容摘要（用作 ETag）与最后修改时间，随索引一起更新
+        self._digests: Dict[str, str] = {}
+        self._last_modified: Dict[str, float] = {}
+        # 目录版本：取变更时刻的微秒时间戳并保证严格递增，重启后也不会回退
+        # 每个条目记录创建与最后变化的版本，删除的条目保留墓碑，供增量同步计算差异
+        # 这些字典只整体替换、不原地修改，请求线程遍历时不会与监听线程的刷新冲突
+        self._last_version = 0
+        self._os_versions: Dict[str, int] = {}
+        self._baselines: Dict[str, int] = {}
+        self._created: Dict[str, Dict[str, int]] = {}
+        self._versions: Dict[str, Dict[str, int]] = {}
+        self._tombstones: Dict[str, Dict[str, int]] = {}
+
+    def build(self) -> None:
+        indexes: Dict[str, Dict[str, SoftwareEntry]] = {}
+        if self.software_root.exists():
+            for os_dir in sorted(p for p in self.software_root.iterdir() if p.is_dir()):
+                indexes[os_dir.name] = scan_os_dir(os_dir)
+        # 整体替换引用，读者不会看到半建好的索引
+        self._indexes = indexes
+        for os_id, entries in indexes.items():
+            self._stamp(os_id, entries)
+            # 本进程内无法得知更早的删除，早于基线的增量请求需要全量重置
+            version = self._next_version()
+            self._baselines[os_id] = version
+            self._created[os_id] = {key: version for key in entries}
+            self._versions[os_id] = dict(self._created[os_id])
+            self._tombstones[os_id] = {}
+            self._os_versions[os_id] = version
+
+    def refresh(self, changes: Iterable[Tuple[str, Optional[str]]]) -> List[str]:
+        """
+        增量重建变更的条目
+        :param changes: (os_id, key) 列表，key 为 None 表示整个 os 目录重扫
+        :return: 实际发生变化的 os_id 列表
+        """
+        by_os: Dict[str, set] = {}
+        for os_id, key in changes:
+            keys = by_os.setdefault(os_id, set())
+            if key is None:
+                keys.add(None)
+            elif None not in keys:
+                keys.add(key)
+
+        changed: List[str] = []
+        for os_id, keys in by_os.items():
+            os_dir = self.software_root / os_id
+            old = self._indexes.get(os_id, {})
+            if None in keys:
+                new = scan_os_dir(os_dir) if os_dir.is_dir() else {}
+            else:
+                new = dict(old)
+                for key in keys:
+                    entry = build_entry(os_dir, key)
+                    if entry is None:
+                        new.pop(key, None)
+                    else:
+                        new[key] = entry
+            if new == old and (os_id in self._indexes) == os_dir.is_dir():
+                continue
+
+            # 先拷贝再替换，保证读者总是看到完整的一份索引
+            indexes = dict(self._indexes)
+            if os_dir.is_dir():
+                indexes[os_id] = dict(sorted(new.items()))
+            else:
+                indexes.pop(os_id, None)
+            self._indexes = indexes
+            self._stamp(os_id, indexes.get(os_id, {}))
+            self._record_versions(os_id, old, indexes.get(os_id, {}))
+            changed.append(os_id)
+        return changed
+
+    def _next_version(self) -> int:
+        self._last_version = max(time.time_ns() // 1000, self._last_version + 1)
+        return self._last_version
+
+    def _record_versions(
+        self, os_id: str, old: Dict[str, SoftwareEntry], new: Dict[str, SoftwareEntry]
+    ) -> None:
+        # 只有接口输出的内容变化才算变更，单纯的 mtime 变化不产生新版本
+        added = [key for key in new if key not in old]
+        changed = [key for key in new if key in old and new[key].to_item() != old[key].to_item()]
+        removed = [key for key in old if key not in new]
+        if not (added or changed or removed):
+            return
+        version = self._next_version()
+        self._baselines.setdefault(os_id, version)
+        # 拷贝后修改再整体替换，与 refresh() 替换 _indexes 的方式一致
+        created = dict(self._created.get(os_id, {}))
+        versions = dict(self._versions.get(os_id, {}))
+        tombstones = dict(self._tombstones.get(os_id, {}))
+        for key in added:
+            created[key] = version
+            versions[key] = version
+            tombstones.pop(key, None)
+        for key in changed:
+            versions[key] = version
+        for key in removed:
+            created.pop(key, None)
+            versions.pop(key, None)
+            tombstones[key] = version
+        self._created[os_id] = created
+        self._versions[os_id] = versions
+        self._tombstones[os_id] = tombstones
+        self._os_versions[os_id] = version
+
+    def version(self, os_id: str) -> int:
+        """目录当前版本，没有任何条目时为 0"""
+        return self._os_versions.get(os_id, 0)
+
+    def changes(self, os_id: str, since: Optional[int]) -> Optional[Dict[str, List]]:
+        """
+        计算 since 之后的增量：新增、变化的条目与删除的 key
+        :return: since 早于基线（或未提供）时返回 None，调用方应改为全量下发
+        """
+        baseline = self._baselines.get(os_id)
+        if since is None or baseline is None or since < baseline:
+            return None
+        entries = self._indexes.get(os_id, {})
+        created = self._created.get(os_id, {})
+        added: List[SoftwareEntry] = []
+        changed: List[SoftwareEntry] = []
+        for key, version in self._versions.get(os_id, {}).items():
+            if version <= since or key not in entries:
+                continue
+            (added if created.get(key, 0) > since else changed).append(entries[key])
+        removed = [key for key, version in self._tombstones.get(os_id, {}).items() if version > since]
+        return {"added": added, "changed": changed, "removed": sorted(removed)}
+
+    def _stamp(self, os_id: str, entries: Dict[str, SoftwareEntry]) -> None:
+        # 摘要只覆盖接口输出的内容，与文件 mtime 无关，跨进程/机器稳定
+        hasher = hashlib.sha256()
+        for key in sorted(entries):
+            hasher.update(json.dumps(entries[key].to_item(), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+            hasher.update(b"\n")
+        digest = hasher.hexdigest()
+        if self._digests.get(os_id) == digest:
+            # 只有 mtime 变化（如 touch）时接口输出不变，代数与 Last-Modified 保持不变
+            return
+        self._digests[os_id] = digest
+        # Last-Modified 取摘要变化的时刻而不是最新文件的 mtime，删除最新的文件也不会让它回退；
+        # 记录时即截断到整秒，与 HTTP 日期的精度一致
+        self._last_modified[os_id] = float(int(time.time()))
+        self._generations[os_id] = self._generations.get(os_id, 0) + 1
+
+    def generation(self, os_id: str) -> int:
+        return self._generations.get(os_id, 0)
+
+    def digest(self, os_id: str) -> str:
+        return self._digests.get(os_id, hashlib.sha256(b"").hexdigest())
+
+    def last_modified(self, os_id: str) -> float:
+        return self._last_modified.get(os_id, 0.0)
+
+    def os_ids(self) -> List[str]:
+        return list(self._indexes.keys())
+
+    def entries(self, os_id: str) -> List[SoftwareEntry]:
+        return list(self._indexes.get(os_id, {}).values())
+
+    def get(self, os_id: str, key: str) -> Optional[SoftwareEntry]:
+        return self._indexes.get(os_id, {}).get(key)
+
+    def resolve_path(self, path: Path) -> Optional[Tuple[str, Optional[str]]]:
+        """将变化的文件路径映射为 (os_id, key)，与目录约定无关的文件返回 None"""
+        try:
+            parts = Path(path).relative_to(self.software_root).parts
+        except ValueError:
+            return None
+        if not parts:
+            return None
+        os_id = parts[0]
+        if len(parts) < 3:
+            # os 目录本身或其子目录整体增删，整体重扫
+            return (os_id, None)
+        if len(parts) != 3:
+            return None
+        sub, name = parts[1], parts[2]
+        stem, _, ext = name.rpartition(".")
+        if not stem:
+            return None
+        if (sub, ext) in (("scripts", "sh"), ("metadata", "json")) or (sub == "icons" and ext in ICON_EXTS):
+            return (os_id, stem)
+        return None
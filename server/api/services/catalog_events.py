@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncGenerator, Dict, Iterable, Optional
+
+from .catalog import CatalogIndex
+
+
+# 空闲时发送心跳的间隔，避免代理断开长连接
+HEARTBEAT_INTERVAL = 15.0
+
+
+class CatalogEvents:
+    """
+    目录变化的广播：监听器刷新索引后调用 publish，所有订阅者被唤醒并检查自己关心的 os_id
+    每个连接只是一个空闲的协程，取代大量客户端的定时全量轮询
+    """
+
+    def __init__(self, catalog: CatalogIndex):
+        self.catalog = catalog
+        self._changed = asyncio.Event()
+
+    def publish(self, os_ids: Iterable[str]) -> None:
+        if not list(os_ids):
+            return
+        # 唤醒当前所有等待者，之后的等待者使用新的 Event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def snapshot(self, os_id: str) -> Dict[str, object]:
+        return {
+            "os_id": os_id,
+            "generation": self.catalog.generation(os_id),
+            "version": self.catalog.version(os_id),
+        }
+
+    async def stream(
+        self, os_id: str, since: Optional[int] = None
+    ) -> AsyncGenerator[Optional[Dict[str, object]], None]:
+        """
+        :param since: 订阅者已知的目录版本；与当前版本不同（或为空）时先推送一次当前状态
+        :return: 目录状态；None 为心跳
+        """
+        last = since
+        while True:
+            changed = self._changed
+            state = self.snapshot(os_id)
+            if state["version"] != last:
+                last = state["version"]
+                yield state
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield None
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .catalog import CatalogIndex
+
+try:  # uvicorn[standard] 自带 watchfiles（基于 inotify），缺失时退回 mtime 轮询
+    from watchfiles import awatch
+except ImportError:  # pragma: no cover
+    awatch = None
+
+
+logger = logging.getLogger(__name__)
+
+WATCH_MODES = ("auto", "inotify", "poll", "off")
+
+
+class CatalogWatcher:
+    """
+    监听 data/software 目录变化，只重建变化的 <key> 条目并原子替换到索引中
+    :param mode: auto（优先 inotify）/ inotify / poll / off
+    :param on_change: 索引刷新后在事件循环中调用，参数为发生变化的 os_id 列表
+    """
+
+    def __init__(
+        self,
+        catalog: CatalogIndex,
+        mode: str = "auto",
+        poll_interval: float = 2.0,
+        on_change: Optional[Callable[[List[str]], None]] = None,
+    ):
+        if mode not in WATCH_MODES:
+            raise ValueError(f"unknown catalog watch mode: {mode}")
+        self.catalog = catalog
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        if self.mode == "off" or self._task is not None:
+            return
+        self._stop_event = asyncio.Event()
+        use_inotify = self.mode in ("auto", "inotify") and awatch is not None and self.catalog.software_root.exists()
+        if self.mode == "inotify" and not use_inotify:
+            logger.warning("inotify watch unavailable, falling back to mtime polling")
+        runner = self._run_inotify() if use_inotify else self._run_poll()
+        self._task = asyncio.create_task(runner)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        assert self._stop_event is not None
+        # 先通知正常退出（awatch 会在 stop_event 置位后结束），超时再强制取消
+        self._stop_event.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=5)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            pass
+        self._task = None
+
+    def _apply(self, paths: Set[Path]) -> List[str]:
+        changes = {c for c in (self.catalog.resolve_path(p) for p in paths) if c is not None}
+        if not changes:
+            return []
+        try:
+            changed = self.catalog.refresh(changes)
+        except Exception:
+            logger.exception("catalog refresh failed")
+            return []
+        for os_id in changed:
+            logger.info("catalog %s reloaded, generation=%d", os_id, self.catalog.generation(os_id))
+        return changed
+
+    async def _apply_async(self, paths: Set[Path]) -> None:
+        # 刷新在线程中完成，通知回到事件循环中进行
+        changed = await asyncio.to_thread(self._apply, paths)
+        if changed and self.on_change is not None:
+            self.on_change(changed)
+
+    async def _run_inotify(self) -> None:
+        assert awatch is not None and self._stop_event is not None
+        async for batch in awatch(self.catalog.software_root, stop_event=self._stop_event):
+            paths = {Path(p) for _, p in batch}
+            await self._apply_async(paths)
+
+    async def _run_poll(self) -> None:
+        assert self._stop_event is not None
+        previous = await asyncio.to_thread(_snapshot, self.catalog.software_root)
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.poll_interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            current = await asyncio.to_thread(_snapshot, self.catalog.software_root)
+            changed = {p for p in previous.keys() | current.keys() if previous.get(p) != current.get(p)}
+            previous = current
+            if changed:
+                await self._apply_async(changed)
+
+
+def _snapshot(root: Path) -> Dict[Path, Tuple[int, int]]:
+    """记录 <os>/<子目录>/<文件> 以及目录本身的 (mtime_ns, size)"""
+    result: Dict[Path, Tuple[int, int]] = {}
+    if not root.exists():
+        return result
+    for dirpath, dirnames, filenames in os.walk(root):
+        base = Path(dirpath)
+        for name in dirnames:
+            result[base / name] = (0, 0)
+        for name in filenames:
+            path = base / name
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            result[path] = (st.st_mtime_ns, st.st_size)
+    return result
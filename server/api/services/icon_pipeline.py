@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import base64
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from .catalog import SoftwareEntry
+
+try:  # Pillow 为可选依赖，未安装时不缩放、不转 WebP，原样提供图标
+    from PIL import Image, features
+except ImportError:  # pragma: no cover
+    Image = None
+    features = None
+
+
+logger = logging.getLogger(__name__)
+
+# 生成的缩略图边长，列表页的图标显示为 72px，64/128 分别对应普通屏与高分屏
+ICON_SIZES = (64, 128)
+DEFAULT_ICON_SIZE = 64
+
+MEDIA_TYPES = {"png": "image/png", "webp": "image/webp", "svg": "image/svg+xml"}
+
+
+class IconPipeline:
+    """
+    图标处理：把图标统一缩放为 size x size（保持比例、透明填充）并生成 PNG 与 WebP 两种格式
+    结果按源文件内容哈希缓存到 <cache_dir>/<sha256>-<size>.<png|webp>，源文件不变时直接复用；
+    SVG 为矢量图，原样提供
+    """
+
+    def __init__(self, cache_dir: Path, sizes: Tuple[int, ...] = ICON_SIZES):
+        self.cache_dir = cache_dir
+        self.sizes = sizes
+        if Image is None:
+            logger.warning("Pillow is not installed: icons are served unscaled and without WebP variants")
+
+    @property
+    def formats(self) -> Tuple[str, ...]:
+        if Image is None:
+            return ("png",)
+        if features.check("webp"):
+            return ("png", "webp")
+        return ("png",)
+
+    def prepare(self, entries: Iterable[SoftwareEntry]) -> int:
+        """
+        建立索引或目录变化后调用：为所有图标预先生成缺失的变体，并清理不再被引用的缓存
+        :return: 新生成的文件数
+        """
+        if Image is None:
+            return 0
+        created = 0
+        keep = set()
+        for entry in entries:
+            if not _is_raster(entry):
+                continue
+            for size in self.sizes:
+                for fmt in self.formats:
+                    path = self._variant_path(entry, size, fmt)
+                    keep.add(path.name)
+                    if not path.exists() and self._render(entry, size, fmt) is not None:
+                        created += 1
+        try:
+            stale = [p for p in self.cache_dir.iterdir() if p.name not in keep and not p.name.startswith(".tmp-")]
+        except OSError:
+            stale = []
+        for path in stale:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        return created
+
+    def variant(self, entry: SoftwareEntry, size: int, fmt: str) -> Optional[Tuple[bytes, str]]:
+        """
+        取图标的一个变体，返回 (内容, Content-Type)；缓存缺失时当场生成
+        无法处理时（SVG、未安装 Pillow、请求的格式不可用）退回原图
+        """
+        if entry.icon_path is None:
+            return None
+        if _is_raster(entry) and Image is not None and fmt in self.formats and size in self.sizes:
+            path = self._variant_path(entry, size, fmt)
+            try:
+                return path.read_bytes(), MEDIA_TYPES[fmt]
+            except OSError:
+                content = self._render(entry, size, fmt)
+                if content is not None:
+                    return content, MEDIA_TYPES[fmt]
+        try:
+            content = entry.icon_path.read_bytes()
+        except OSError:
+            return None
+        return content, MEDIA_TYPES.get(entry.icon_path.suffix.lstrip("."), "application/octet-stream")
+
+    def _variant_path(self, entry: SoftwareEntry, size: int, fmt: str) -> Path:
+        return self.cache_dir / f"{entry.icon_hash.partition(':')[2]}-{size}.{fmt}"
+
+    def _render(self, entry: SoftwareEntry, size: int, fmt: str) -> Optional[bytes]:
+        assert Image is not None and entry.icon_path is not None
+        tmp_name: Optional[str] = None
+        try:
+            with Image.open(entry.icon_path) as source:
+                image = source.convert("RGBA")
+            image.thumbnail((size, size), Image.LANCZOS)
+            canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+            canvas.paste(image, ((size - image.width) // 2, (size - image.height) // 2))
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                if fmt == "webp":
+                    canvas.save(f, "WEBP", quality=85, method=6)
+                else:
+                    canvas.save(f, "PNG", optimize=True)
+            path = self._variant_path(entry, size, fmt)
+            os.replace(tmp_name, path)
+            return path.read_bytes()
+        except Exception as e:
+            logger.warning("failed to render icon %s (%d, %s): %s", entry.icon_path, size, fmt, e)
+            if tmp_name is not None and os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            return None
+
+
+def data_url(content: bytes, media_type: str) -> str:
+    return f"data:{media_type};base64,{base64.b64encode(content).decode('ascii')}"
+
+
+def _is_raster(entry: SoftwareEntry) -> bool:
+    return entry.icon_path is not None and bool(entry.icon_hash) and entry.icon_path.suffix.lower() != ".svg"
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:  # brotli 列在 requirements.txt 中；导入失败时只提供 gzip
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+# 序列化时 URL 前缀先写成占位符，不同 base 只需做一次字节替换
+BASE_PLACEHOLDER = "\x00BASE\x00"
+_PLACEHOLDER_JSON = json.dumps(BASE_PLACEHOLDER)[1:-1].encode("utf-8")
+
+
+@dataclass
+class EncodedBody:
+    """同一份响应体的多种编码，键为 Content-Encoding（identity 表示不压缩）"""
+
+    generation: int
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+
+def dumps(content: object) -> bytes:
+    # 与 starlette JSONResponse 的序列化参数保持一致
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encode_variants(body: bytes) -> Dict[str, bytes]:
+    variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    return variants
+
+
+def choose_encoding(accept_encoding: Optional[str], available: List[str]) -> str:
+    """按 Accept-Encoding（含 q 值）选择编码，同等权重时优先 br > gzip > identity"""
+    if not accept_encoding:
+        return "identity"
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    # 客户端接受的压缩编码中取 q 值最高者，同分时按 br、gzip 顺序
+    candidates = [
+        (weights.get(name, weights.get("*", 0.0)), -order, name)
+        for order, name in enumerate(("br", "gzip"))
+        if name in available
+    ]
+    candidates = [c for c in candidates if c[0] > 0]
+    if not candidates:
+        return "identity"
+    return max(candidates)[2]
+
+
+class CatalogResponseCache:
+    """
+    缓存已序列化、已压缩的目录列表响应
+    - 模板：每个 os_id 一份，URL 前缀为占位符，目录代数变化时重建
+    - 成品：每个 (os_id, base) 一份，含 identity/gzip/br 变体
+    模板与成品都按 LRU 限制数量；调用方只应缓存目录中存在的 os_id，其余传 store=False
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._templates: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+        self._bodies: "OrderedDict[Tuple[str, str], EncodedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, os_id: str, base: str, generation: int, render: Callable[[str], object], store: bool = True
+    ) -> EncodedBody:
+        """
+        :param render: 以 URL 前缀为参数生成响应内容，仅在缓存失效时调用
+        :param store: 为 False 时不读写缓存（如查询参数中未知的 os_id），避免任意参数值占用缓存
+        """
+        cache_key = (os_id, base)
+        template = None
+        if store:
+            with self._lock:
+                cached = self._bodies.get(cache_key)
+                if cached is not None and cached.generation == generation:
+                    self._bodies.move_to_end(cache_key)
+                    return cached
+                template = self._templates.get(os_id)
+
+        if template is None or template[0] != generation:
+            template = (generation, dumps(render(BASE_PLACEHOLDER)))
+        body = template[1].replace(_PLACEHOLDER_JSON, json.dumps(base)[1:-1].encode("utf-8"))
+        encoded = EncodedBody(generation=generation, variants=encode_variants(body))
+        if not store:
+            return encoded
+
+        with self._lock:
+            self._templates[os_id] = template
+            self._templates.move_to_end(os_id)
+            while len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+            self._bodies[cache_key] = encoded
+            self._bodies.move_to_end(cache_key)
+            while len(self._bodies) > self.max_entries:
+                self._bodies.popitem(last=False)
+        return encoded
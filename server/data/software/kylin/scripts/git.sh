@@ -1,2 +1,2 @@
-sudo apt update
+[ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || sudo apt update
 sudo apt install git
\ No newline at end of file
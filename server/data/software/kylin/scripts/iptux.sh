@@ -4,7 +4,8 @@
 set -ex
 
 # Install 飞秋
-apt-get update
+# 安装器在 TTL 内刷新过索引时跳过
+[ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update
 apt-get install -y iptux
 
 # Desktop icon
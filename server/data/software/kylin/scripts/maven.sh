@@ -1,2 +1,2 @@
-apt update
+[ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt update
 echo "安装 Maven 完成"
\ No newline at end of file
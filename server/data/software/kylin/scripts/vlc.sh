@@ -3,7 +3,8 @@
 set -ex
 
 # Install VLC
-apt-get update
+# 安装器在 TTL 内刷新过索引时跳过
+[ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update
 apt-get install -y vlc
 
 # Desktop icon
@@ -4,7 +4,12 @@
 #!/usr/bin/env bash
 set -ex
 
-wget -q http://192.168.2.239:8081/repository/apt-internal/pool/b/bruno/bruno_2.13.2_amd64.deb -O bruno.deb
+# 安装器已预取时直接使用本地文件
+if [ -f "${APPSTORE_ARTIFACTS_DIR:-}/bruno.deb" ]; then
+    cp "${APPSTORE_ARTIFACTS_DIR}/bruno.deb" bruno.deb
+else
+    wget -q http://192.168.2.239:8081/repository/apt-internal/pool/b/bruno/bruno_2.13.2_amd64.deb -O bruno.deb
+fi
 
 apt-get install -y ./bruno.deb
 
@@ -1,2 +1,12 @@
+#!/bin/bash
+set -e
 echo "==== Git installation started ===="
+
+# 套装安装时这些包已由合并的 apt 事务装好
+if [ -z "${APPSTORE_APT_BATCHED:-}" ]; then
+    # 安装器在 TTL 内刷新过索引时跳过
+    [ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update
+    apt-get install -y git
+fi
+
 echo "==== Git installation ended ===="
\ No newline at end of file
@@ -4,8 +4,12 @@
 set -ex
 
 # Install 飞秋
-apt-get update
-apt-get install -y iptux
+# 套装安装时这些包已由合并的 apt 事务装好
+if [ -z "${APPSTORE_APT_BATCHED:-}" ]; then
+  # 安装器在 TTL 内刷新过索引时跳过
+  [ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update
+  apt-get install -y iptux
+fi
 
 # Desktop icon
 cp /usr/share/applications/io.github.iptux_src.iptux.desktop $HOME/Desktop/
@@ -3,8 +3,12 @@ set -e
 echo "==== JDK installation started ===="
 
 # 1. 安装 JDK
-apt-get update
-apt-get install -y openjdk-17-jdk
+# 套装安装时这些包已由合并的 apt 事务装好
+if [ -z "${APPSTORE_APT_BATCHED:-}" ]; then
+    # 安装器在 TTL 内刷新过索引时跳过
+    [ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update
+    apt-get install -y openjdk-17-jdk
+fi
 
 # 2. 写系统级 profile 片段
 cat > /etc/profile.d/jdk17.sh <<'EOF'
@@ -3,8 +3,12 @@ set -e
 echo "==== MySQL installation started ===="
 
 # 1. 更新索引并安装
-apt-get update -qq
-apt-get install -y mysql-server mysql-client
+# 套装安装时这些包已由合并的 apt 事务装好
+if [ -z "${APPSTORE_APT_BATCHED:-}" ]; then
+    # 安装器在 TTL 内刷新过索引时跳过
+    [ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update -qq
+    apt-get install -y mysql-server mysql-client
+fi
 
 # 2. 启动 & 开机自启
 # 确保数据目录存在
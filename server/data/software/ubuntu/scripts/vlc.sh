@@ -3,8 +3,12 @@
 set -ex
 
 # Install VLC
-apt-get update
-apt-get install -y vlc
+# 套装安装时这些包已由合并的 apt 事务装好
+if [ -z "${APPSTORE_APT_BATCHED:-}" ]; then
+  # 安装器在 TTL 内刷新过索引时跳过
+  [ -n "${APPSTORE_APT_INDEX_FRESH:-}" ] || apt-get update
+  apt-get install -y vlc
+fi
 
 # Desktop icon
 cp /usr/share/applications/vlc.desktop $HOME/Desktop/
@@ -4,7 +4,12 @@
 set -ex
 
 # Install vsCode
-wget -q http://192.168.2.239:8081/repository/apt-internal/pool/c/code/code_1.105.1-1760482543_amd64.deb -O vs_code.deb
+# 安装器已预取时直接使用本地文件
+if [ -f "${APPSTORE_ARTIFACTS_DIR:-}/vs_code.deb" ]; then
+    cp "${APPSTORE_ARTIFACTS_DIR}/vs_code.deb" vs_code.deb
+else
+    wget -q http://192.168.2.239:8081/repository/apt-internal/pool/c/code/code_1.105.1-1760482543_amd64.deb -O vs_code.deb
+fi
 # apt-get update
 apt-get install -y ./vs_code.deb
 
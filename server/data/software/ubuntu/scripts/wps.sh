@@ -4,7 +4,12 @@
 #!/usr/bin/env bash
 set -ex
 
-wget -q http://192.168.2.239:8081/repository/apt-internal/pool/w/wps-office/wps-office_12.1.2.22571.AK.preread.sw_amd64.deb -O wps-office.deb
+# 安装器已预取时直接使用本地文件
+if [ -f "${APPSTORE_ARTIFACTS_DIR:-}/wps-office.deb" ]; then
+    cp "${APPSTORE_ARTIFACTS_DIR}/wps-office.deb" wps-office.deb
+else
+    wget -q http://192.168.2.239:8081/repository/apt-internal/pool/w/wps-office/wps-office_12.1.2.22571.AK.preread.sw_amd64.deb -O wps-office.deb
+fi
 
 apt-get install -y ./wps-office.deb
 